@@ -0,0 +1,107 @@
+#!/usr/bin/env python2.7
+# scoring.py
+# Thomas Boser
+
+"""
+Scoring of predicted tracks against the truth. both are read from files in
+the tracks_soln.csv format (eid,hbc, hbc, ... one track per line, see
+Particle.printSolution and eventWriter.solnLines) into flat arrays of event
+id, hit barcode and track number.
+
+hits are matched on (event id, hit barcode) with a sort and a binary
+search, and every predicted track is given the truth track most of its hits
+belong to (majority vote over the sorted (predicted, truth) pairs).
+
+accuracy    fraction of truth hits in a predicted track whose majority truth
+            track they belong to (the "% of hits correctly" of README.ipynb)
+efficiency  fraction of truth tracks matched by a predicted track, matched
+            means more than half the hits of both tracks are shared
+fakerate    fraction of predicted tracks not matched to a truth track
+
+usage = python2.7 -m Analysis.scoring truthfile predictedfile
+"""
+
+from __future__ import print_function, division
+
+import sys
+import numpy as np
+
+def loadSoln(path):
+    """ read a solution file, returns int64 arrays (eid, hbc, track) with one
+        entry per hit, track is the line number of the track """
+    with open(path, 'rb') as f:
+        return parseSoln(f.read())
+
+def parseSoln(text):
+    """ parse tracks_soln.csv lines into (eid, hbc, track) arrays """
+    lines = text.translate(None, b'[] \r').strip().split(b'\n')
+    text = b',-1,'.join(line.rstrip(b',') for line in lines if line) #-1 ends a line
+    if not text: return tuple(np.zeros(0, dtype=np.int64) for i in range(3))
+    values = np.fromstring(text, dtype=np.int64, sep=',')
+    end = values == -1
+    track = np.cumsum(end) - end
+    first = np.r_[True, end[:-1]] #first value of a line is the event id
+    eid = values[first]
+    hit = ~(first | end)
+    return eid[track[hit]], values[hit], track[hit]
+
+def scoreSoln(truth, pred):
+    """ score predicted tracks against the truth, both (eid, hbc, track)
+        arrays as returned by loadSoln. returns a dict with accuracy,
+        efficiency, fakerate and the hit and track counts """
+    teid, thbc, ttrack = truth
+    peid, phbc, ptrack = pred
+    ntruth = int(ttrack.max()) + 1 if len(ttrack) else 0
+    npred = int(ptrack.max()) + 1 if len(ptrack) else 0
+
+    #truth track of every predicted hit, ntruth for hits not in the truth
+    tkey = _hitKey(teid, thbc)
+    pkey = _hitKey(peid, phbc)
+    match = np.full(len(pkey), ntruth, dtype=np.int64)
+    if len(tkey):
+        order = np.argsort(tkey)
+        pos = np.minimum(np.searchsorted(tkey[order], pkey), len(tkey) - 1)
+        known = tkey[order][pos] == pkey
+        match[known] = ttrack[order][pos[known]]
+
+    #number of shared hits of every (predicted, truth) pair, largest per predicted track
+    pairs, shared = np.unique(ptrack*(ntruth + 1) + match, return_counts=True)
+    pt, tt = pairs // (ntruth + 1), pairs % (ntruth + 1)
+    valid = tt < ntruth
+    pt, tt, shared = pt[valid], tt[valid], shared[valid]
+    best = np.lexsort((-shared, pt))
+    pt, tt, shared = pt[best], tt[best], shared[best]
+    first = np.ones(len(pt), dtype=bool)
+    first[1:] = pt[1:] != pt[:-1]
+    pt, tt, shared = pt[first], tt[first], shared[first]
+
+    tsize = np.bincount(ttrack, minlength=ntruth)
+    psize = np.bincount(ptrack, minlength=npred)
+    matched = (2*shared > tsize[tt]) & (2*shared > psize[pt])
+
+    #a hit given to several tracks counts once
+    majority = np.full(npred, -1, dtype=np.int64)
+    majority[pt] = tt
+    correct = np.unique(pkey[match == majority[ptrack]])
+    return {'accuracy': len(correct) / max(len(thbc), 1),
+            'efficiency': len(np.unique(tt[matched])) / max(ntruth, 1),
+            'fakerate': (npred - matched.sum()) / max(npred, 1),
+            'hits': len(thbc), 'tracks': ntruth, 'predicted': npred}
+
+def printScore(score):
+    """ print a score dict returned by scoreSoln """
+    print("You predicted", round(100*score['accuracy'], 2), "% of hits correctly.")
+    print("Track efficiency", round(100*score['efficiency'], 2), "%, fake rate",
+          round(100*score['fakerate'], 2), "%")
+    print(score['predicted'], "predicted tracks,", score['tracks'], "true tracks,",
+          score['hits'], "hits")
+
+def _hitKey(eid, hbc):
+    """ single int64 key per (event id, hit barcode) """
+    return eid.astype(np.int64) << 40 | hbc.astype(np.int64)
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("usage: python2.7 -m Analysis.scoring truthfile predictedfile")
+        exit(1)
+    printScore(scoreSoln(loadSoln(sys.argv[1]), loadSoln(sys.argv[2])))
@@ -0,0 +1,152 @@
+#!/usr/bin/env python2.7
+# datasetCache.py
+# Thomas Boser
+
+"""
+On-disk cache of generated datasets. a dataset is stored under a key hashing
+its generation parameters and the source of the generation code, so the same
+parameters with the same code give back the dataset made before and any
+change to either makes a new one.
+
+    cache = DatasetCache('/path/to/cache', maxbytes)
+    path = cache.get(params, build) #build(path) writes the dataset on a miss
+
+every entry is a directory named after its key holding the dataset files and
+cache.json (the parameters and code version). the modification time of
+cache.json is the last time the entry was used, once the cache holds more
+than maxbytes the least recently used entries are deleted. a dataset is built
+in a .building- directory first, those of killed builds are deleted once
+nothing was written to them for a day.
+"""
+
+from __future__ import print_function
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+
+META = 'cache.json'
+BUILDING = '.building-' #prefix of the temporary directory of a build
+STALE = 24*60*60 #seconds without a write after which a build counts as killed
+#code writing a dataset, relative to the repository root: the Generation
+#package and the build_datasets.py driver (data_io.py only reads datasets)
+SOURCES = ('Generation', 'build_datasets.py')
+
+def codeVersion(root = None, sources = SOURCES):
+    """ hash of the python sources (files or packages) under root, default
+        the repository root. changes whenever the generation code does """
+    if root is None: root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    digest = hashlib.sha1()
+    for source in sources:
+        for path in _pyFiles(os.path.join(root, source)):
+            digest.update(os.path.relpath(path, root).encode('utf-8'))
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+def _pyFiles(path):
+    """ sorted python files under path, or path itself if it is a file """
+    if os.path.isfile(path): return [path]
+    found = []
+    for p, dirs, files in sorted(os.walk(path)):
+        found += [os.path.join(p, name) for name in sorted(files) if name.endswith('.py')]
+    return found
+
+def cacheKey(params, version = None):
+    """ key of a dataset generated with params (a json serializable dict) by
+        code version (default codeVersion()) """
+    if version is None: version = codeVersion()
+    text = json.dumps({'params': params, 'version': version}, sort_keys=True)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def dirSize(path):
+    """ bytes of all files under path """
+    return sum(os.path.getsize(os.path.join(p, name))
+               for p, dirs, files in os.walk(path) for name in files)
+
+def lastWrite(path):
+    """ latest modification time of path and everything under it """
+    return max([os.path.getmtime(path)] +
+               [os.path.getmtime(os.path.join(p, name))
+                for p, dirs, files in os.walk(path) for name in dirs + files])
+
+class DatasetCache:
+    """ datasets keyed by their generation parameters, with least recently
+        used entries evicted past maxbytes """
+    def __init__(self, root, maxbytes):
+        """ cache constructor, root is the cache directory (created if needed)
+            and maxbytes the size it is kept under """
+        self.root = root
+        self.maxbytes = maxbytes
+        self.version = codeVersion()
+        if not os.path.isdir(root): os.makedirs(root)
+
+    def path(self, key):
+        """ directory of the entry key """
+        return os.path.join(self.root, key)
+
+    def lookup(self, params):
+        """ directory of the dataset of params marked as just used, None if it
+            is not cached """
+        path = self.path(cacheKey(params, self.version))
+        if not os.path.isfile(os.path.join(path, META)):
+            return None
+        os.utime(os.path.join(path, META), None)
+        return path
+
+    def get(self, params, build):
+        """ directory of the dataset of params, made by build(directory) if it
+            is not cached. the dataset is built in a temporary directory and
+            renamed into place, so an interrupted build leaves no entry """
+        path = self.lookup(params)
+        if path is not None:
+            return path
+        key = cacheKey(params, self.version)
+        tmp = tempfile.mkdtemp(prefix=BUILDING + key, dir=self.root)
+        try:
+            os.chmod(tmp, 0o755) #mkdtemp makes it private to the user
+            build(tmp)
+            with open(os.path.join(tmp, META), 'w') as f:
+                json.dump({'params': params, 'version': self.version,
+                           'created': time.time()}, f, indent=2, sort_keys=True)
+        except:
+            shutil.rmtree(tmp)
+            raise
+        try:
+            os.rename(tmp, self.path(key))
+        except OSError: #built at the same time by another process
+            shutil.rmtree(tmp)
+            if not os.path.isfile(os.path.join(self.path(key), META)): raise
+        self.evict(keep = key)
+        return self.path(key)
+
+    def entries(self):
+        """ (last used, bytes, key) of every entry, least recently used first """
+        entries = []
+        for key in os.listdir(self.root):
+            meta = os.path.join(self.path(key), META)
+            if key.startswith('.') or not os.path.isfile(meta): continue
+            entries.append((os.path.getmtime(meta), dirSize(self.path(key)), key))
+        return sorted(entries)
+
+    def evict(self, keep = None):
+        """ delete least recently used entries until the cache holds at most
+            maxbytes, never the entry keep. builds left behind by a killed
+            process (nothing written for STALE seconds) are deleted first """
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if not name.startswith(BUILDING): continue
+            try:
+                if time.time() - lastWrite(path) > STALE: shutil.rmtree(path)
+            except OSError: #renamed into place meanwhile
+                pass
+        entries = self.entries()
+        total = sum(size for used, size, key in entries)
+        for used, size, key in entries:
+            if total <= self.maxbytes: break
+            if key == keep: continue
+            shutil.rmtree(self.path(key))
+            total -= size
@@ -0,0 +1,93 @@
+#!/usr/bin/env python2.7
+# detectorGeometry.py
+# Thomas Boser
+
+"""
+Detector geometry shared by generation and reconstruction. detectors are
+circles around the origin and a geometry is the set of their radii, kept
+sorted so detector positions count outwards and the detector of a hit is
+found with a binary search over the radii.
+
+geometry files hold radii separated by commas, spaces or newlines, anything
+after a # on a line is a comment:
+
+    # inner barrel
+    1000, 2000, 3000
+    4000 5000
+"""
+
+from __future__ import print_function
+
+import os
+import bisect
+import numpy as np
+
+class DetectorGeometry:
+    """ sorted, duplicate free detector radii """
+    def __init__(self, radii = ()):
+        """ geometry constructor, radii is an optional iterable of radii """
+        self.clear()
+        for r in radii: self.addDetector(r)
+
+    def addDetector(self, r):
+        """ add detector of radius r, returns False if there already is one """
+        if r in self.known: #prevent duplicate detectors
+            return False
+        self.known.add(r)
+        bisect.insort(self.values, r)
+        self.radii = np.array(self.values, dtype=np.float64)
+        return True
+
+    def removeDetector(self, r):
+        """ remove detector of radius r, returns False if there is none """
+        if r not in self.known:
+            return False
+        self.known.remove(r)
+        self.values.remove(r)
+        self.radii = np.array(self.values, dtype=np.float64)
+        return True
+
+    def clear(self):
+        """ delete every detector """
+        self.known = set()
+        self.values = [] #radii as given, sorted
+        self.radii = np.zeros(0)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __contains__(self, r):
+        return r in self.known
+
+    def layerOf(self, x, y):
+        """ index into the sorted radii of the detector closest to each point """
+        return self.layerOfRadius(np.hypot(x, y))
+
+    def layerOfRadius(self, r):
+        """ index into the sorted radii of the detector closest to each radius """
+        mids = (self.radii[1:] + self.radii[:-1]) / 2
+        return np.searchsorted(mids, r)
+
+def parseGeometry(text):
+    """ geometry of the radii in text, see module docstring """
+    radii = []
+    for line in text.splitlines():
+        for token in line.split('#')[0].replace(',', ' ').split():
+            r = float(token)
+            radii.append(int(r) if r == int(r) else r)
+    return DetectorGeometry(radii)
+
+def loadGeometry(path):
+    """ read a geometry file, see module docstring """
+    with open(path) as f:
+        return parseGeometry(f.read())
+
+def geometryOf(spec):
+    """ geometry from a command line value, either a geometry file or radii
+        like 1000,2000,3000 """
+    if os.path.isfile(spec):
+        return loadGeometry(spec)
+    return parseGeometry(spec)
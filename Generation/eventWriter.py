@@ -0,0 +1,225 @@
+#!/usr/bin/env python2.7
+# eventWriter.py
+# Thomas Boser
+
+"""
+Formatting and writing of dataset files. Whole events are formatted at once
+from the arrays given by Event.hitArrays and Event.trackArrays and written
+with one write call per file, the print methods of Hit and Particle use the
+same line formats.
+
+hits.csv         eid,hbc,x,y (shuffled, see ShuffledWriter)
+tracks.csv       eid,pbc,charge,phi,0,hbc, hbc, ...
+tracks_soln.csv  eid,hbc, hbc, ...
+
+ColumnWriter writes the hits as one binary .npy file per column instead,
+see COLUMNS for names and dtypes. those files can be opened as memory maps
+with numpy.load(f, mmap_mode='r') or data_io.loadColumns.
+
+IndexedWriter keeps the hits of every event together (shuffled within the
+event) and writes an index next to the hits file (hits.csv.idx) so single
+events can be read without the others, see data_io.loadEvents.
+
+hits.csv.idx     eid,offset,length,rows (bytes of the event in hits.csv)
+"""
+
+from __future__ import print_function
+
+import os
+import struct
+import tempfile
+import numpy as np
+
+from itertools import repeat
+from utils import instrument
+
+HIT_FORMAT = '%d,%d,%r,%r\n'
+HITINFO_FORMAT = '%d,%d,%d,%r, %r\n'
+TRACK_FORMAT = '%d,%d,%d,%r,0,%s\n'
+SOLN_FORMAT = '%d,%s\n'
+INDEX_FORMAT = '%d,%d,%d,%d\n'
+INDEX_SUFFIX = '.idx' #index of hits.csv is hits.csv.idx
+
+#column name, dtype of the binary hit columns
+COLUMNS = (('eid', '<i4'), ('hbc', '<i8'), ('x', '<f8'), ('y', '<f8'),
+           ('layer', '<i2'), ('pbc', '<i8'))
+NPY_HEADER = 128 #fixed .npy header size so the row count can be filled in last
+
+def hitLines(eid, hbc, x, y):
+    """ dataset lines for arrays of hits of event eid """
+    return ''.join(HIT_FORMAT % row for row in zip(repeat(eid), hbc.tolist(),
+                                                   x.tolist(), y.tolist()))
+
+def hitInfoLines(eid, hbc, pbc, x, y):
+    """ lines with hit and particle barcodes for arrays of hits of event eid """
+    return ''.join(HITINFO_FORMAT % row for row in zip(hbc.tolist(), pbc.tolist(),
+                                                       repeat(eid), x.tolist(),
+                                                       y.tolist()))
+
+def trackLines(eid, pbc, charge, phi, hbc, offsets):
+    """ truth lines of event eid. the hits of particle i are
+        hbc[offsets[i]:offsets[i+1]] """
+    hbcs = _joinHits(hbc, offsets)
+    return ''.join(TRACK_FORMAT % row for row in zip(repeat(eid), pbc.tolist(),
+                                                     charge.tolist(), phi.tolist(),
+                                                     hbcs))
+
+def solnLines(eid, hbc, offsets):
+    """ solution lines of event eid, hits grouped like trackLines. eid can
+        also be an array with the event id of every line """
+    eids = repeat(eid) if np.ndim(eid) == 0 else eid.tolist()
+    return ''.join(SOLN_FORMAT % row for row in zip(eids, _joinHits(hbc, offsets)))
+
+def _joinHits(hbc, offsets):
+    """ ', ' joined hit barcodes of every particle """
+    hbc = [str(h) for h in hbc.tolist()]
+    offsets = offsets.tolist()
+    return [", ".join(hbc[offsets[i]:offsets[i+1]]) for i in range(len(offsets) - 1)]
+
+class EventWriter:
+    """ writes whole events to open hits, tracks and solution files """
+    def __init__(self, hitf, truthf, solnf):
+        """ writer constructor, takes open file objects """
+        self.hitf = hitf
+        self.truthf = truthf
+        self.solnf = solnf
+        self.nhits = 0 #rows written to the hits file
+        self.ntracks = 0 #rows written to the tracks and solution files
+
+    def writeEvent(self, event):
+        """ write the hits, truths and solutions of event """
+        self.writeHits(event)
+        tracks = event.trackArrays() #repacks the hits on the oo engine, so once
+        self.writeTruths(event, tracks)
+        self.writeSolutions(event, tracks)
+        self.ntracks += len(tracks[0])
+
+    @instrument.timed('writeHits')
+    def writeHits(self, event):
+        """ write the hits of event to the hits file """
+        hbc, pbc, x, y, detpos = event.hitArrays()
+        self.hitf.write(hitLines(event.eventid, hbc, x, y))
+        self.nhits += len(hbc)
+
+    @instrument.timed('writeTruths')
+    def writeTruths(self, event, tracks = None):
+        """ write the truths of event to the tracks file, tracks is
+            event.trackArrays() if already at hand """
+        if tracks is None: tracks = event.trackArrays()
+        pbc, charge, phi, hbc, offsets = tracks
+        self.truthf.write(trackLines(event.eventid, pbc, charge, phi, hbc, offsets))
+
+    @instrument.timed('writeSolutions')
+    def writeSolutions(self, event, tracks = None):
+        """ write the solutions of event to the solution file, tracks as in
+            writeTruths """
+        if tracks is None: tracks = event.trackArrays()
+        pbc, charge, phi, hbc, offsets = tracks
+        self.solnf.write(solnLines(event.eventid, hbc, offsets))
+
+    def close(self):
+        """ close the three files """
+        self.hitf.close()
+        self.truthf.close()
+        self.solnf.close()
+
+class ShuffledWriter:
+    """ file-like object that writes all lines given to it to f in random
+        order. lines are scattered over nbuckets temporary files while
+        writing and each bucket is shuffled in memory on close, so only about
+        1/nbuckets of the lines are held at once and f is written once """
+    def __init__(self, f, nbuckets = 64, seed = None, tmpdir = None):
+        """ writer constructor, f is an open file, tmpdir is where the
+            buckets go (default system temp directory) """
+        if nbuckets < 1: raise ValueError("a shuffle needs at least one bucket")
+        self.f = f
+        self.rng = np.random.RandomState(seed)
+        self.buckets = [tempfile.TemporaryFile(mode='w+', dir=tmpdir)
+                        for i in range(nbuckets)]
+
+    def write(self, text):
+        """ send every line of text to a random bucket """
+        lines = text.splitlines(True)
+        if len(lines) == 0: return
+        ids = self.rng.randint(len(self.buckets), size=len(lines))
+        order = np.argsort(ids, kind='mergesort')
+        bounds = np.searchsorted(ids[order], np.arange(len(self.buckets) + 1))
+        for b in np.nonzero(np.diff(bounds))[0]:
+            self.buckets[b].write(''.join(lines[i] for i in order[bounds[b]:bounds[b+1]]))
+
+    @instrument.timed('shuffleHits')
+    def close(self):
+        """ shuffle the buckets one by one into f, then close everything """
+        for bucket in self.buckets:
+            bucket.seek(0)
+            lines = bucket.readlines()
+            self.rng.shuffle(lines)
+            self.f.write(''.join(lines))
+            bucket.close()
+        self.buckets = []
+        self.f.close()
+
+class IndexedWriter:
+    """ file-like object that writes the lines of every write call, one whole
+        event as EventWriter writes them, to f in random order and one line
+        eid,offset,length,rows per event to indexf. the event id is the
+        first value of the lines """
+    def __init__(self, f, indexf, seed = None):
+        """ writer constructor, f and indexf are open files """
+        self.f = f
+        self.indexf = indexf
+        self.rng = np.random.RandomState(seed)
+        self.offset = 0
+
+    def write(self, text):
+        """ write the lines of one event in random order and index them """
+        lines = text.splitlines(True)
+        if len(lines) == 0: return
+        self.rng.shuffle(lines)
+        block = ''.join(lines)
+        self.f.write(block)
+        self.indexf.write(INDEX_FORMAT % (int(lines[0].split(',', 1)[0]), self.offset,
+                                          len(block), len(lines)))
+        self.offset += len(block)
+
+    def close(self):
+        """ close the hits and index files """
+        self.f.close()
+        self.indexf.close()
+
+class ColumnWriter:
+    """ writes the hits of whole events as binary columns (see COLUMNS), one
+        .npy file per column in directory path. rows are in event order """
+    def __init__(self, path):
+        """ writer constructor, creates path if needed """
+        if not os.path.exists(path): os.makedirs(path)
+        self.nrows = 0
+        self.files = []
+        for name, dtype in COLUMNS:
+            f = open(os.path.join(path, name + '.npy'), 'wb')
+            f.write(_npyHeader(dtype, 0)) #rewritten on close
+            self.files.append(f)
+
+    @instrument.timed('writeColumns')
+    def writeEvent(self, event):
+        """ append the hits of event to the columns """
+        hbc, pbc, x, y, detpos = event.hitArrays()
+        eid = np.full(len(hbc), event.eventid)
+        for f, col, (name, dtype) in zip(self.files, (eid, hbc, x, y, detpos, pbc), COLUMNS):
+            f.write(np.asarray(col).astype(dtype).tobytes())
+        self.nrows += len(hbc)
+
+    def close(self):
+        """ fill in the row count and close the column files """
+        for f, (name, dtype) in zip(self.files, COLUMNS):
+            f.seek(0)
+            f.write(_npyHeader(dtype, self.nrows))
+            f.close()
+        self.files = []
+
+def _npyHeader(dtype, n):
+    """ .npy (version 1.0) header of a 1d array of n dtype values, padded to
+        NPY_HEADER bytes """
+    header = "{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }" % (dtype, n)
+    header = header.ljust(NPY_HEADER - 10 - 1) + '\n'
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1')
@@ -0,0 +1,255 @@
+#!/usr/bin/env python2.7
+# npgenerateEvents.py
+# Thomas Boser
+
+"""
+Columnar version of oogenerateEvents.Event. Particles of an event are kept
+as numpy arrays (one entry per particle) and the hits of every particle with
+every detector are computed in a single broadcast instead of one Particle and
+one circ_intersect call at a time.
+
+Output format is the same as the object path. With equivalent = True the
+random values are drawn from a random.Random in the same order as
+oogenerateEvents.Event/oogenerateParticles.Particle, so both engines given
+random.Random(s) (or the random module after random.seed(s)) generate the
+same event.
+
+hits are cached per detector radius (see utils.util.LayerCache), adding or
+removing a detector computes or drops only its column.
+"""
+
+from __future__ import print_function, division
+
+import sys
+import random
+import numpy as np
+import eventWriter as ew
+import detectorGeometry as dg
+
+from utils.util import helix_intersect_arr, BarcodeAllocator, LayerCache
+from utils import instrument
+
+class Event:
+    """ columnar controller for particles, hits, and detectors of a single event """
+    def __init__(self, eventid, detrad, equivalent = False, rng = None):
+        """ event constructor, every random value of the event is drawn from
+            rng, a numpy RandomState (default the global numpy state) or with
+            equivalent = True a random.Random (default the random module) """
+        self.eventid = eventid
+        self.equivalent = equivalent
+        if rng is None: rng = random if equivalent else np.random
+        self.rng = rng
+
+        self.geometry = dg.DetectorGeometry()
+        self.detrad = [] #radii of self.geometry
+        self.layers = LayerCache() #hits by detector radius
+        for rad in detrad: self.addDetector(rad) #create detectors
+
+        self.clearParticles()
+
+    ##############################################################################
+    ##################          PARTICLE METHODS          ########################
+    ##############################################################################
+    def clearParticles(self):
+        """ delete every particle (and therefore every hit) """
+        self.barcodes = BarcodeAllocator(equivalent = self.equivalent, rng = self.rng)
+        self.hitlayers = list(self.detrad) #radii the columns of self.hbc are for
+        self.pbc = np.zeros(0, dtype=np.int64)
+        self.hbc = np.zeros((0, len(self.hitlayers)), dtype=np.int64)
+        self.vx = np.zeros(0)
+        self.vy = np.zeros(0)
+        self.p = np.zeros(0)
+        self.theta = np.zeros(0)
+        self.phi = np.zeros(0)
+        self.charge = np.zeros(0, dtype=np.int64)
+        self.layers.reset()
+        self.clearHits()
+
+    @instrument.timed('createParticles')
+    def createParticles(self, n):
+        """ add n particles to the event """
+        if len(self.detrad) == 0:
+            print("Please generate detectors before generating particles")
+            return
+        if self.numParticles() == 0: #detectors may have changed since the last particles
+            self.hitlayers = list(self.detrad)
+            self.hbc = np.zeros((0, len(self.hitlayers)), dtype=np.int64)
+        pbc, hbc = self.generateBarcodes(n)
+        if self.equivalent:
+            vx, vy, p, theta, phi, charge = self._drawEquivalent(n)
+        else:
+            vx, vy, p, theta, phi, charge = self._draw(n)
+
+        self.pbc = np.concatenate((self.pbc, pbc))
+        self.hbc = np.concatenate((self.hbc, hbc.reshape(n, len(self.hitlayers))))
+        self.vx = np.concatenate((self.vx, vx))
+        self.vy = np.concatenate((self.vy, vy))
+        self.p = np.concatenate((self.p, p))
+        self.theta = np.concatenate((self.theta, theta))
+        self.phi = np.concatenate((self.phi, phi))
+        self.charge = np.concatenate((self.charge, charge))
+        self.clearHits()
+        instrument.count(self.eventid, 'particles', n)
+
+    def numParticles(self):
+        """ number of particles in the event """
+        return len(self.pbc)
+
+    def printParticles(self):
+        """ print all particles to stdout """
+        for i in range(self.numParticles()):
+            print(self.pbc[i], ',', [float(self.vx[i]), float(self.vy[i]), 0], ',',
+                  [float(self.p[i]), float(self.theta[i]), float(self.phi[i])], ',',
+                  self.charge[i], sep='')
+
+    def printnumParticles(self):
+        """ print number of particles initialized """
+        print("There are", self.numParticles(), "particles.")
+
+    def printTruths(self):
+        """ prints ground truth to stdout """
+        pbc, charge, phi, hbc, offsets = self.trackArrays()
+        sys.stdout.write(ew.trackLines(self.eventid, pbc, charge, phi, hbc, offsets))
+
+    def printSolutions(self):
+        """ prints solution to stdout """
+        pbc, charge, phi, hbc, offsets = self.trackArrays()
+        sys.stdout.write(ew.solnLines(self.eventid, hbc, offsets))
+
+    def trackArrays(self):
+        """ particle barcodes, charges and phis, with the hit barcodes of
+            particle i in hbc[offsets[i]:offsets[i+1]] """
+        if self.hitmask is None: self.computeallHits()
+        offsets = np.zeros(self.numParticles() + 1, dtype=np.int64)
+        np.cumsum(self.hitmask.sum(axis=1), out=offsets[1:])
+        return self.pbc, self.charge, self.phi, self.hithbc[self.hitmask], offsets
+
+    ##############################################################################
+    ##################             HIT METHODS            ########################
+    ##############################################################################
+    @instrument.timed('computeallHits')
+    def computeallHits(self, recompute = False):
+        """ compute hits for all particles with all detectors at once, only
+            for detectors or particles added since the last call unless
+            recompute is given """
+        if self.hitmask is not None and not recompute:
+            return
+        if recompute: self.layers.clear()
+        self.hitx, self.hity, self.hithbc = self.layers.stack(self.detrad, self.numParticles(),
+                                                              self._intersectLayer)
+        self.hitmask = ~np.isnan(self.hitx)
+        if instrument.enabled(): #particles whose circle misses a detector
+            instrument.count(self.eventid, 'hits', self.numHits())
+            instrument.count(self.eventid, 'misses', self.hitmask.size - self.numHits())
+
+    def numHits(self):
+        """ number of computed hits """
+        if self.hitmask is None: return 0
+        return int(self.hitmask.sum())
+
+    def printallHits(self, dataset = False):
+        """ print all hits to stdout, particle by particle in detector order """
+        hbc, pbc, x, y, detpos = self.hitArrays()
+        if dataset:
+            sys.stdout.write(ew.hitLines(self.eventid, hbc, x, y))
+        else:
+            sys.stdout.write(ew.hitInfoLines(self.eventid, hbc, pbc, x, y))
+
+    def hitArrays(self):
+        """ hit barcodes, particle barcodes, x, y and detector positions
+            (1 based) of all hits as arrays, particle by particle in detector
+            order """
+        if self.hitmask is None: self.computeallHits()
+        pind, dind = np.nonzero(self.hitmask)
+        return (self.hithbc[self.hitmask], self.pbc[pind],
+                self.hitx[self.hitmask], self.hity[self.hitmask], dind + 1)
+
+    def printnumHits(self):
+        """ print number of computed hits """
+        print("There are", self.numHits(), "hits.")
+
+    def clearHits(self):
+        """ delete every hit, the intersections in self.layers are kept """
+        self.hitx = None
+        self.hity = None
+        self.hithbc = None
+        self.hitmask = None
+
+    def _intersectLayer(self, r, start):
+        """ x, y (nan for misses) and hit barcodes of the particles from start
+            on with the detector of radius r, computed for self.layers """
+        hits, mask = helix_intersect_arr(np.column_stack((self.vx[start:], self.vy[start:])),
+                                         np.column_stack((self.p[start:], self.theta[start:],
+                                                          self.phi[start:])),
+                                         self.charge[start:], [r])
+        x = np.where(mask[:, 0], hits[:, 0, 0], np.nan)
+        y = np.where(mask[:, 0], hits[:, 0, 1], np.nan)
+        return x, y, self.layers.barcodes(r, start, len(x), self.hitlayers, self.hbc,
+                                          self.barcodes)
+
+    ##############################################################################
+    ##################          DETECTOR METHODS          ########################
+    ##############################################################################
+    def addDetector(self, r):
+        """ add detector of radius r, detectors are kept sorted by radius """
+        if self.geometry.addDetector(r): #prevent duplicate detectors
+            self.detrad[:] = self.geometry.values
+            self.clearHits()
+
+    def removeDetector(self, r):
+        """ remove detector of radius r and its cached hits """
+        if self.geometry.removeDetector(r):
+            self.detrad[:] = self.geometry.values
+            self.layers.drop(r)
+            self.clearHits()
+
+    def clearDetectors(self):
+        """ delete every detector """
+        self.geometry.clear()
+        self.detrad[:] = []
+        self.layers.clear()
+        self.clearHits()
+
+    def printDetectors(self):
+        """ print all detectors to stdout """
+        for r in self.detrad:
+            print("Center = ", np.array([0, 0]),", radius = ", r, sep='')
+
+    def printnumDetectors(self):
+        """ print number of initialized detectors """
+        print("There are", len(self.detrad), "detectors.")
+
+    ##############################################################################
+    ##################            HELPER METHODS          ########################
+    ##############################################################################
+    def clearController(self):
+        """ clear controller of all values """
+        self.clearDetectors()
+        self.clearParticles()
+
+    def generateBarcodes(self, n):
+        """ returns n shuffled particle barcodes and n*len(hitlayers) shuffled
+            hit barcodes following the ones already issued """
+        return self.barcodes.issue(n, len(self.hitlayers))
+
+    def _draw(self, n):
+        """ draw particle values for n particles with numpy """
+        rng = self.rng
+        vx = np.round(rng.uniform(-.03, .03, n), 7)
+        vy = np.round(rng.uniform(-.03, .03, n), 7)
+        p = np.round(rng.uniform(4000, 15000, n), 2)
+        theta = np.round(rng.uniform(0, 4, n), 5)
+        phi = np.round(rng.uniform(-4, 4, n), 5)
+        charge = rng.randint(-1, 2, n).astype(np.int64)
+        return vx, vy, p, theta, phi, charge
+
+    def _drawEquivalent(self, n):
+        """ draw particle values in the order of oogenerateParticles.genParticle """
+        rng = self.rng
+        vals = np.zeros((n, 6))
+        for i in range(n):
+            vals[i] = [round(rng.uniform(.03, -.03),7), round(rng.uniform(.03, -.03),7),
+                       round(rng.uniform(15000, 4000),2), round(rng.uniform(4, 0),5),
+                       round(rng.uniform(4, -4),5), rng.randint(-1, 1)]
+        return (vals[:, 0], vals[:, 1], vals[:, 2], vals[:, 3], vals[:, 4],
+                vals[:, 5].astype(np.int64))
@@ -5,13 +5,14 @@
 from __future__ import print_function
 
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
+
+ORIGIN = np.array([0, 0]) #2d vector, origin center assumption
+ORIGIN.flags.writeable = False #shared by every detector
 
 class Detector:
     """ detector constructor """
     def __init__(self, radius):
-        self.center = np.array([0, 0]) #2d vector, origin center assumption
+        self.center = ORIGIN
         self.radius = radius
 
     #override equals and not equals operators to prevent duplicate detectors
@@ -21,13 +22,13 @@ class Detector:
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __hash__(self):
+        return hash(self.radius)
+
     def plotDetector(self):
         """ plot a detector (circle) to plt figure """
-        ax = plt.gca()
-        ax.add_patch(patches.Circle((self.center[0], 
-                                     self.center[1]),
-                                     self.radius,
-                                     fill = False))
+        import visualize as vis #loads matplotlib
+        vis.circle(self.center, self.radius)
 
     def printDetector(self):
         """ print detector information to stdout """
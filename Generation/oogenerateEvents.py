@@ -4,49 +4,67 @@
 
 from __future__ import print_function, division
 
+import sys
 import random
-import matplotlib.pyplot as plt
+import numpy as np
 import oogenerateParticles as gp
 import oogenerateDetectors as gd
+import oogenerateHits as gh
+import eventWriter as ew
+import detectorGeometry as dg
 
 from math import sqrt
+from utils.util import BarcodeAllocator, LayerCache
+from utils import instrument
 
 class Event:
     """ controller class for particles, hits, and detectors of a single event """
-    def __init__(self, eventid, detrad):
-        """ event constructor """
+    def __init__(self, eventid, detrad, rng = None):
+        """ event constructor, every random value of the event is drawn from
+            rng, a random.Random (default the random module) """
         self.eventid = eventid
-        self.pbc = []
-        self.hbc = []
+        self.rng = random if rng is None else rng
+        self.barcodes = BarcodeAllocator(equivalent = True, rng = self.rng)
 
-        self.particles = []
-        self.hits = []
-        self.detectors = []
+        self.hits = gh.HitCollection() #hits of all particles, see computeallHits
+        self.particles = gp.ParticleTable(0, self.hits)
+        self.layers = LayerCache() #hits by detector radius
+        self.hitsvalid = False #whether self.hits holds the hits of the current detectors
+
+        self.geometry = dg.DetectorGeometry()
+        self.detectors = [] #Detector of every radius of self.geometry
         for rad in detrad: self.addDetector(rad) #create detectors
+        self.hitlayers = list(self.geometry) #radii the hitbcs of the particles are for
+        self.particles = gp.ParticleTable(len(self.hitlayers), self.hits)
 
         #weird way to track plot state, i'm sure there is a better way to do this
         self.plotState = []
+        self.plotmax = None #most particles plotted, see plotSample
 
     ##############################################################################
     ##################          PARTICLE METHODS          ########################
     ##############################################################################
     def clearParticles(self):
-        """ delete every particle in self.particles """
-        self.particles[:] = []
+        """ delete every particle in self.particles (and therefore every hit) """
+        self.particles.clear()
+        self.layers.reset()
+        self.clearHits()
 
+    @instrument.timed('createParticles')
     def createParticles(self, n):
         """ add n particles to self.particles, increment bcTracker """
         if len(self.detectors) == 0:
             print("Please generate detectors before generating particles")
             return
-        p_ind = len(self.pbc)
-        h_ind = len(self.hbc)
-        self.generateBarcodes(n) #generate n random barcodes.
-        tl = len(self.detectors)
+        if len(self.particles) == 0: #detectors may have changed since the last particles
+            self.hitlayers = list(self.geometry)
+            self.particles = gp.ParticleTable(len(self.hitlayers), self.hits)
+        pbc, hbc = self.generateBarcodes(n) #generate n random barcodes.
+        tl = len(self.hitlayers)
         for i in range(n):
-            self.particles.append(gp.Particle(self.pbc[p_ind+i], 
-                                  self.hbc[h_ind+(tl*i):h_ind+(tl*i)+tl],
-                                  self.eventid))
+            self.particles.append(pbc[i], hbc[tl*i:tl*i+tl], self.eventid, self.rng)
+        self.hitsvalid = False
+        instrument.count(self.eventid, 'particles', n)
 
     def printParticles(self):
         """ print all particles in self.particles to stdout """
@@ -59,46 +77,115 @@ class Event:
 
     def printTruths(self):
         """ prints ground truth to stdout """
-        for particle in self.particles:
-            particle.printTruth()
+        pbc, charge, phi, hbc, offsets = self.trackArrays()
+        sys.stdout.write(ew.trackLines(self.eventid, pbc, charge, phi, hbc, offsets))
 
     def printSolutions(self):
         """ prints solution to stdout """
-        for particle in self.particles:
-            particle.printSolution()
+        pbc, charge, phi, hbc, offsets = self.trackArrays()
+        sys.stdout.write(ew.solnLines(self.eventid, hbc, offsets))
+
+    def trackArrays(self):
+        """ particle barcodes, charges and phis as arrays, with the hit
+            barcodes of particle i in hbc[offsets[i]:offsets[i+1]] """
+        if not self.hitsvalid: self.computeallHits()
+        self.moveHits()
+        particles = self.particles
+        return (particles.pbc, particles.charge, particles.phi, self.hits.hbc,
+                particles.offsets())
 
     ##############################################################################
     ##################             HIT METHODS            ########################
     ##############################################################################
+    @instrument.timed('computeallHits')
     def computeallHits(self, recompute = False):
-        """ compute hits for all particles """
-        for particle in self.particles:
-            particle.getHits(self.detectors, recompute)
+        """ compute hits for all particles into self.hits, particle by
+            particle in detector order. intersections are kept per detector
+            (see self.layers) so after adding detectors or particles only the
+            new ones are computed, recompute computes everything again """
+        if recompute: self.layers.clear()
+        particles = self.particles
+        x, y, hbc = self.layers.stack(self.geometry, len(particles), self._intersectLayer)
+        hit = ~np.isnan(x)
+        pind, dind = np.nonzero(hit) #particle by particle in detector order
+        self.hits = gh.HitCollection(hbc=hbc[hit], pbc=particles.pbc[pind],
+                                     eid=particles.eid[pind], x=x[hit], y=y[hit],
+                                     detpos=dind + 1)
+        particles.hitstore = self.hits
+        particles.nhits[:] = hit.sum(axis=1)
+        particles.hitstart[:] = particles.offsets()[:-1]
+        self.hitsvalid = True
+        if instrument.enabled(): #particles whose circle misses a detector
+            instrument.count(self.eventid, 'hits', len(self.hits))
+            instrument.count(self.eventid, 'misses',
+                             len(self.particles)*len(self.detectors) - len(self.hits))
 
     def printallHits(self, dataset = False):
         """ print all hits in self.hits to stdout """
-        if len(self.hits) == 0: self.moveHits()
-        for hit in self.hits:
-            hit.printHit(dataset)
+        hbc, pbc, x, y, detpos = self.hitArrays()
+        if dataset:
+            sys.stdout.write(ew.hitLines(self.eventid, hbc, x, y))
+        else:
+            sys.stdout.write(ew.hitInfoLines(self.eventid, hbc, pbc, x, y))
+
+    def hitArrays(self):
+        """ hit barcodes, particle barcodes, x, y and detector positions of
+            all hits as arrays """
+        if not self.hitsvalid: self.computeallHits()
+        self.moveHits()
+        hits = self.hits
+        return hits.hbc, hits.pbc, hits.x, hits.y, hits.detpos
 
     def printnumHits(self):
         """ print number of computed hits """
         print("There are", len(self.hits), "hits.")
 
     def clearHits(self):
-        self.hits[:] = []
+        """ delete every hit, of the event and of its particles. the
+            intersections in self.layers are kept, hitArrays and trackArrays
+            compute the hits again """
+        self.hits.clear()
+        self.particles.nhits[:] = 0
+        self.hitsvalid = False
+
+    def _intersectLayer(self, r, start):
+        """ x, y (nan for misses) and hit barcodes of the particles from start
+            on with the detector of radius r, computed for self.layers """
+        detector = self.detectors[self.geometry.values.index(r)]
+        particles = self.particles[start:]
+        x = np.full(len(particles), np.nan)
+        y = np.full(len(particles), np.nan)
+        for i, particle in enumerate(particles):
+            point = particle.getIntersects(detector)
+            if point is not None:
+                x[i], y[i] = point[0], point[1]
+        return x, y, self.layers.barcodes(r, start, len(particles), self.hitlayers,
+                                          self.particles.hitbcs, self.barcodes)
 
     ##############################################################################
     ##################          DETECTOR METHODS          ########################
     ##############################################################################
     def addDetector(self, r):
-        """ add detector of radius r to self.detectors """
-        if gd.Detector(r) not in self.detectors: #prevent duplicate detectors
-            self.detectors.append(gd.Detector(r))
+        """ add detector of radius r to self.detectors, kept sorted by radius """
+        if self.geometry.addDetector(r): #prevent duplicate detectors
+            self.detectors.insert(self.geometry.values.index(r), gd.Detector(r))
+            self.clearHits()
+
+    def removeDetector(self, r):
+        """ remove detector of radius r, its cached intersections and the
+            hits (computed again with the other detectors when needed) """
+        if r in self.geometry:
+            del self.detectors[self.geometry.values.index(r)]
+            self.geometry.removeDetector(r)
+            self.layers.drop(r)
+            self.clearHits()
 
     def clearDetectors(self):
         """delete every detector in self.detectors """
+        self.geometry.clear()
         self.detectors[:] = []
+        self.layers.clear()
+        self.clearHits()
 
     def printDetectors(self):
         """ print all detectors in self.detectors to stdout """
@@ -142,6 +229,11 @@ class Event:
             self.plotState.append(self._plotDetectors)
         self.showPlot()
 
+    def plotSample(self, n):
+        """ plot only n particles (and their hits) spread over the event,
+            None plots every particle """
+        self.plotmax = n
+
     def clearPlot(self):
         """ clear plot """
         self.plotState[:] = []
@@ -156,62 +248,65 @@ class Event:
         self.clearPlot()
         self.clearHits()
 
+    @instrument.timed('moveHits')
     def moveHits(self):
-        """ move hits from particles to particlecontroller after computing """
-        self.clearHits()
-        for particle in self.particles:
-            self.hits.extend(particle.hits)
+        """ put the hits of the particles in self.hits in particle order.
+            computeallHits already stores them that way, hits computed
+            particle by particle are copied (see ParticleTable.packHits) """
+        self.hits = self.particles.packHits()
 
     def generateBarcodes(self, n):
-        #particles will be assigned a barcode at index i and particle
-        #barcodes from indices len(self.detectors)*i through 
-        #len(self.detectors)*i + len(self.detectors) -1
-        p_min = 1
-        h_min = 1
-        h_inc = len(self.detectors)
-
-        if (self.pbc): #if there are already barcodes
-            p_min = max(self.pbc) + 1
-            h_min = max(self.hbc) + 1
-
-        new_pbc = range(p_min, p_min+(n), 1)
-        new_hbc = range(h_min, h_min+(h_inc*n), 1)
-
-        random.shuffle(new_pbc)
-        random.shuffle(new_hbc) # shuffle hbc and pbc for randomized barcodes
-
-        self.pbc.extend(new_pbc)
-        self.hbc.extend(new_hbc)
+        """ returns n shuffled particle barcodes and n*len(self.hitlayers)
+            shuffled hit barcodes following the ones already issued """
+        #particle i will be assigned the particle barcode at index i and the
+        #hit barcodes from indices len(self.hitlayers)*i through
+        #len(self.hitlayers)*i + len(self.hitlayers) -1
+        return self.barcodes.issue(n, len(self.hitlayers))
+
+    def _plotSample(self):
+        """ particle indices, offsets and hit rows of the plotted particles """
+        import visualize as vis #loads matplotlib
+        pbc, charge, phi, hbc, offsets = self.trackArrays() #hits in particle order
+        index = vis.sample(len(pbc), self.plotmax)
+        sub, rows = vis.sampleHits(offsets, index)
+        return index, sub, rows
 
     def _plotParticle_origins(self):
         """ actually plots all particle origins, prevents recursion """
-        for particle in self.particles:
-            particle.plotOrigin()
+        import visualize as vis #loads matplotlib
+        index, sub, rows = self._plotSample()
+        vis.points(self.particles.vx[index], self.particles.vy[index], 'r')
 
     def _plotParticle_joins(self):
-        """ actually plots line between points """
-        for particle in self.particles:
-            particle.plotJoins()
+        """ actually plots line between points, all tracks at once """
+        import visualize as vis #loads matplotlib
+        index, sub, rows = self._plotSample()
+        particles = self.particles
+        vis.tracks(particles.vx[index], particles.vy[index], self.hits.x[rows],
+                   self.hits.y[rows], sub, vis.colorsOf(particles.pbc[index]))
 
     def _plotallHits(self):
         """ actually plots all particle hits in self.hits, prevents recursion """
-        for hit in self.hits:
-            hit.plotHit()
+        import visualize as vis #loads matplotlib
+        index, sub, rows = self._plotSample()
+        vis.points(self.hits.x[rows], self.hits.y[rows])
 
     def _plotParticle_hits(self):
-        """ actually plots all particle hits, prevents recursion """
-        for particle in self.particles:
-            particle.plotHits()
+        """ actually plots all particle hits colored by particle, prevents
+            recursion """
+        import visualize as vis #loads matplotlib
+        index, sub, rows = self._plotSample()
+        colors = np.repeat(vis.colorsOf(self.particles.pbc[index]), np.diff(sub), axis=0)
+        vis.points(self.hits.x[rows], self.hits.y[rows], colors)
 
     def _plotDetectors(self):
         """ actually plots all detectors """
-        for detector in self.detectors:
-            detector.plotDetector()
+        import visualize as vis #loads matplotlib
+        vis.circles(self.geometry.radii)
 
     def showPlot(self):
         """ helper command to create new plot with commands used """
+        import visualize as vis #loads matplotlib
         for command in self.plotState: command()
-        plt.scatter(0, 0, c='g') #always plot origin in green
-        plt.gca().set_aspect('equal', adjustable='box')
-        plt.show()
+        vis.show()
 
@@ -10,23 +10,38 @@ hit barcode, particle barcode, [ local hit x,y ] , [ local error ex, ey ], [ glo
 
 from __future__ import print_function
 
+import sys
 import math
 import numpy as np
-import matplotlib.pyplot as plt
+import eventWriter as ew
+
+from utils.util import ColumnStore
+
+class Hit(object):
+    """ a single hit. hits are rows of a HitCollection, a Hit only holds its
+        collection and row so it costs no memory of its own """
+    __slots__ = ('store', 'index')
 
-class Hit:
-    """ hit constructor """
     def __init__(self, pbc, hbc, eid, point, detpos=0):
-        self.hbc = int(hbc)
-        self.pbc = pbc
-        self.eid = eid
-        self.lhit = list(point)
-        self.detpos = detpos #to speed up certain processes
+        """ hit constructor, a hit made on its own gets a collection of its own """
+        store = HitCollection()
+        store.append(pbc, hbc, eid, point, detpos)
+        self.store = store
+        self.index = 0
+
+    hbc = property(lambda self: int(self.store.hbc[self.index]))
+    pbc = property(lambda self: int(self.store.pbc[self.index]))
+    eid = property(lambda self: int(self.store.eid[self.index]))
+    detpos = property(lambda self: int(self.store.detpos[self.index]))
+    lhit = property(lambda self: [float(self.store.x[self.index]),
+                                  float(self.store.y[self.index])])
+
+    def __eq__(self, other):
+        return (isinstance(other, Hit) and self.store is other.store and
+                self.index == other.index)
 
-        ### CURRENTLY UNUSED ###
-        self.lerr = []
-        self.globhit = []
-        self.cxcycharge = [[]*3]
+    def __ne__(self, other):
+        return not self == other
 
     def __str__(self):
         """ overload print operator """
@@ -38,13 +53,45 @@ class Hit:
 
     def plotHit(self):
         """ plot a hit (single point) to plt figure """
-        plt.scatter(self.lhit[0], self.lhit[1])
+        import visualize as vis #loads matplotlib
+        vis.points(self.lhit[0], self.lhit[1])
 
     def printHit(self, dataset = False):
         """ print hit to stdout """
+        self.store[self.index:self.index+1].printHits(dataset)
+
+class HitCollection(ColumnStore):
+    """ hits stored as one numpy array per field (see FIELDS) instead of one
+        object per hit, indexing gives Hit views (see utils.util.ColumnStore) """
+    FIELDS = (('hbc', np.int64), ('pbc', np.int64), ('eid', np.int64),
+              ('x', np.float64), ('y', np.float64), ('detpos', np.int64))
+    view = Hit
+    __slots__ = ()
+
+    hbc = property(lambda self: self.column('hbc'))
+    pbc = property(lambda self: self.column('pbc'))
+    eid = property(lambda self: self.column('eid'))
+    x = property(lambda self: self.column('x'))
+    y = property(lambda self: self.column('y'))
+    detpos = property(lambda self: self.column('detpos'))
+
+    def append(self, pbc, hbc, eid, point, detpos = 0):
+        """ add a single hit, returns its Hit view """
+        return self.add(hbc=hbc, pbc=pbc, eid=eid, x=point[0], y=point[1], detpos=detpos)
+
+    def printHits(self, dataset = False):
+        """ print all hits to stdout, in the Hit.printHit format """
         if dataset:
-            print(self.eid, ',', self.hbc, ',', self.lhit[0], ',', self.lhit[1], sep='')
+            lines = ''.join(ew.HIT_FORMAT % row for row in
+                            zip(self.eid.tolist(), self.hbc.tolist(),
+                                self.x.tolist(), self.y.tolist()))
         else:
-            print(self.hbc, ',', self.pbc, ',', self.eid, ',', 
-                  ", ".join( repr(e) for e in self.lhit), sep='')
+            lines = ''.join(ew.HITINFO_FORMAT % row for row in
+                            zip(self.hbc.tolist(), self.pbc.tolist(), self.eid.tolist(),
+                                self.x.tolist(), self.y.tolist()))
+        sys.stdout.write(lines)
 
+    def plotHits(self):
+        """ plot all hits to plt figure in one call """
+        import visualize as vis #loads matplotlib
+        vis.points(self.x, self.y)
@@ -13,64 +13,97 @@ from __future__ import print_function, division
 import random
 import math
 import oogenerateHits as gh
+import eventWriter as ew
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
 
-from utils.util import pt_dist, circ_intersect
-
-class Particle:
-    """ particle constructor """
-    def __init__(self, barcode, hitbcs, eventid):
-        self.barcode = barcode
-        self.vertices = []
-        self.mangle = []
-        self.charge = None
-
-        self.hits = []
-        self.hitbcs = hitbcs
-
-        self.eid = eventid
-
-        ### FOR PARTICLE GENERATION ###
-        self.p_radius = 0
-        self.centpt = []
-        self.p_circ = None
-        self.m_ray = None
-
-        self.genParticle()
-
-    def genParticle(self):
-        """ generate values for particle """
-        self.vertices = [round(random.uniform(.03, -.03),7), round(random.uniform(.03, -.03),7)\
-                         ,0] #Leaving z at 0, only considering 2d space for now
-        self.mangle = [round(random.uniform(15000, 4000),2), round(random.uniform(4, 0),5),\
-                       round(random.uniform(4, -4),5)]
-        self.charge = random.randint(-1, 1)
+from utils.util import pt_dist, circ_intersect, ColumnStore
+
+class Particle(object):
+    """ a single particle. particles are rows of a ParticleTable, a Particle
+        only holds its table and row """
+    __slots__ = ('store', 'index')
+
+    def __init__(self, barcode, hitbcs, eventid, rng = random):
+        """ particle constructor, a particle made on its own gets a table of
+            its own. rng is a random.Random (default the random module) """
+        particle = ParticleTable(len(hitbcs)).append(barcode, hitbcs, eventid, rng)
+        self.store = particle.store
+        self.index = particle.index
+
+    barcode = property(lambda self: int(self._field('pbc')))
+    eid = property(lambda self: int(self._field('eid')))
+    charge = property(lambda self: int(self._field('charge')))
+    p_radius = property(lambda self: float(self._field('radius')))
+    hitbcs = property(lambda self: self._field('hitbcs').tolist())
+    vertices = property(lambda self: [float(self._field('vx')),
+                                      float(self._field('vy')), 0])
+    mangle = property(lambda self: [float(self._field('p')),
+                                    float(self._field('theta')),
+                                    float(self._field('phi'))])
+
+    def __eq__(self, other):
+        return (isinstance(other, Particle) and self.store is other.store and
+                self.index == other.index)
+
+    def __ne__(self, other):
+        return not self == other
+
+    @property
+    def centpt(self):
+        """ center of the particle circle, empty for neutral particles """
+        if self.charge == 0: return []
+        return [float(self._field('cx')), float(self._field('cy'))]
+
+    def _field(self, name):
+        """ value of field name of the particle """
+        return self.store.columns[name][self.index]
+
+    @property
+    def hits(self):
+        """ HitCollection of the computed hits of the particle """
+        start = int(self._field('hitstart'))
+        return self.store.hits[start:start + int(self._field('nhits'))]
+
+    def genParticle(self, rng = random):
+        """ generate values for particle with rng (a random.Random) """
+        vertices = [round(rng.uniform(.03, -.03),7), round(rng.uniform(.03, -.03),7)\
+                    ,0] #Leaving z at 0, only considering 2d space for now
+        mangle = [round(rng.uniform(15000, 4000),2), round(rng.uniform(4, 0),5),\
+                  round(rng.uniform(4, -4),5)]
+        charge = rng.randint(-1, 1)
 
         #particle trajectory estimations
         magfield = 1 # we will assume the magnetic field is uniform
-        if self.charge != 0: 
-            self.p_radius = abs(self.mangle[0] / (self.charge * magfield))
-            self.centpt = [self.vertices[0] + (self.p_radius*math.sin(self.mangle[2])),
-                           self.vertices[1] + (self.p_radius*math.cos(self.mangle[2]))]
+        p_radius, centpt = 0, [0, 0]
+        if charge != 0:
+            p_radius = abs(mangle[0] / (charge * magfield))
+            centpt = [vertices[0] + (p_radius*math.sin(mangle[2])),
+                      vertices[1] + (p_radius*math.cos(mangle[2]))]
+        self.store.set(self.index, vx=vertices[0], vy=vertices[1], p=mangle[0],
+                       theta=mangle[1], phi=mangle[2], charge=charge,
+                       radius=p_radius, cx=centpt[0], cy=centpt[1])
 
     def getHits(self, detectors, override = False):
-        """ produces all hits with the detectors specified, appends them
-            to self.hits, assumes particles travel in circular motion so
-            this is an approximation """
-        if len(self.hits) == 0 or override == True: #if hits are not yet computed
+        """ produces all hits with the detectors specified, appends them to
+            the hits of the particle table and keeps their rows with the
+            particle, assumes particles travel in circular motion so this
+            is an approximation """
+        if self._field('nhits') == 0 or override == True: #if hits are not yet computed
+            store = self.store.hits
+            start = len(store)
+            barcode, hitbcs, eid = self.barcode, self.hitbcs, self.eid
             for detpos, det in enumerate(detectors):
                 poss_hits = self.getIntersects(det)
                 if poss_hits is not None:
-                    self.hits.append(gh.Hit(self.barcode, self.hitbcs[detpos],
-                                            self.eid, poss_hits, detpos+1))
+                    store.append(barcode, hitbcs[detpos], eid, poss_hits, detpos+1)
+            self.store.set(self.index, hitstart=start, nhits=len(store) - start)
 
     def getIntersects(self, detector):
         """ returns intersection pts of two cirles (or a line and a circle).
             does so using custom methods. """
-        m_intersect = [detector.radius*math.cos(self.mangle[0])+self.vertices[0],
-                       detector.radius*math.sin(self.mangle[0])+self.vertices[1]]
+        p, vertices = float(self._field('p')), self.vertices
+        m_intersect = [detector.radius*math.cos(p)+vertices[0],
+                       detector.radius*math.sin(p)+vertices[1]]
         if self.charge == 0: #if charge is 0 particle travels in straight line
             return m_intersect
         else: #circle circle intersection if particle is charged
@@ -85,24 +118,21 @@ class Particle:
 
     def plotOrigin(self):
         """ plot the origin point for the particle """
-        plt.scatter(self.vertices[0], self.vertices[1], c='r')
+        import visualize as vis #loads matplotlib
+        vis.points(self.vertices[0], self.vertices[1], 'r')
 
 
     def plotJoins(self):
         """ plot all hits joined by a line """
-        col = random.choice('bgrcmyk') #chose random color
-        #self.hits.sort(key=lambda x: x.detpos)
-        origin = self.vertices
-        for hit in self.hits:
-            plt.plot((origin[0], hit.lhit[0]),
-                     (origin[1], hit.lhit[1]),
-                      color = col)
-            origin = hit.lhit
+        import visualize as vis #loads matplotlib
+        hits = self.hits
+        vertices = self.vertices
+        vis.tracks(np.array([vertices[0]]), np.array([vertices[1]]), hits.x, hits.y,
+                   np.array([0, len(hits)]), vis.colorsOf([self.barcode]))
 
     def plotHits(self):
         """ plot all hits in self.hits """
-        for hit in self.hits:
-            hit.plotHit()
+        self.hits.plotHits()
 
     def printParticle(self):
         """ print particle to stdout """
@@ -110,16 +140,95 @@ class Particle:
 
     def printTruth(self):
         """ print particle track truth """
-        print(self.eid, ',', self.barcode, ',', self.charge, ',', self.mangle[2],
-              ',', 0, ',', ", ".join( repr(e) for e in self.hits), sep='')
+        print(ew.TRACK_FORMAT % (self.eid, self.barcode, self.charge, self.mangle[2],
+                                 ", ".join( repr(e) for e in self.hits)), end='')
 
     def printSolution(self):
         """ print particle solution to stdout """
-        print(self.eid, ',', ", ".join( repr(e) for e in self.hits), sep='')
+        print(ew.SOLN_FORMAT % (self.eid, ", ".join( repr(e) for e in self.hits)), end='')
 
     def printHits(self):
         """ print hits to stdout """
-        for hit in self.hits:
-            hit.printHit()
-
-
+        self.hits.printHits()
+
+class ParticleTable(ColumnStore):
+    """ particles of an event stored as one numpy array per field (see
+        FIELDS), indexing gives Particle views (see utils.util.ColumnStore).
+        radius, cx and cy describe the circle of a charged particle, hitbcs
+        holds the hit barcode reserved for every detector and the hits of
+        particle i are rows hitstart[i]:hitstart[i]+nhits[i] of the
+        HitCollection self.hits """
+    FIELDS = (('pbc', np.int64), ('eid', np.int64), ('vx', np.float64),
+              ('vy', np.float64), ('p', np.float64), ('theta', np.float64),
+              ('phi', np.float64), ('charge', np.int64), ('radius', np.float64),
+              ('cx', np.float64), ('cy', np.float64), ('hitstart', np.int64),
+              ('nhits', np.int64), ('hitbcs', np.int64))
+    view = Particle
+    __slots__ = ('hitstore',)
+
+    def __init__(self, ndet = 0, hits = None, **columns):
+        """ table constructor, ndet is the number of hit barcodes per particle,
+            hits the HitCollection the hits go to (a new one by default) """
+        size = len(list(columns.values())[0]) if columns else 0
+        columns.setdefault('hitbcs', np.zeros((size, ndet), dtype=np.int64))
+        ColumnStore.__init__(self, **columns)
+        self.hitstore = gh.HitCollection() if hits is None else hits
+
+    pbc = property(lambda self: self.column('pbc'))
+    eid = property(lambda self: self.column('eid'))
+    vx = property(lambda self: self.column('vx'))
+    vy = property(lambda self: self.column('vy'))
+    p = property(lambda self: self.column('p'))
+    theta = property(lambda self: self.column('theta'))
+    phi = property(lambda self: self.column('phi'))
+    charge = property(lambda self: self.column('charge'))
+    radius = property(lambda self: self.column('radius'))
+    cx = property(lambda self: self.column('cx'))
+    cy = property(lambda self: self.column('cy'))
+    hitstart = property(lambda self: self.column('hitstart'))
+    nhits = property(lambda self: self.column('nhits'))
+    hitbcs = property(lambda self: self.column('hitbcs'))
+    hits = property(lambda self: self.root.hitstore)
+
+    def append(self, barcode, hitbcs, eventid, rng = random):
+        """ add a new particle with random values drawn from rng (see
+            Particle.genParticle), returns its Particle view """
+        particle = self.add(pbc=barcode, hitbcs=hitbcs, eid=eventid)
+        particle.genParticle(rng)
+        return particle
+
+    def set(self, i, **values):
+        """ set field values of row i of the whole table """
+        for name, value in values.items():
+            self.root.columns[name][i] = value
+
+    def computeHits(self, detectors, override = False):
+        """ compute the hits of every particle, particle by particle in
+            detector order """
+        for particle in self:
+            particle.getHits(detectors, override)
+
+    def offsets(self):
+        """ CSR offsets of the hits, the hits of particle i are rows
+            offsets[i]:offsets[i+1] of the HitCollection given by packHits """
+        offsets = np.zeros(self.size + 1, dtype=np.int64)
+        np.cumsum(self.nhits, out=offsets[1:])
+        return offsets
+
+    def packHits(self):
+        """ HitCollection of the hits of all particles in particle order.
+            computeHits already stores them that way, otherwise (hits computed
+            particle by particle or recomputed) they are copied into a new
+            collection the table uses from then on """
+        if self.root is not self:
+            raise ValueError("only a whole ParticleTable can be packed")
+        hits = self.hits
+        offsets = self.offsets()
+        if len(hits) == offsets[-1] and (self.hitstart == offsets[:-1]).all():
+            return hits
+        rows = np.repeat(self.hitstart - offsets[:-1], self.nhits) + np.arange(offsets[-1])
+        packed = gh.HitCollection(**dict((name, hits.column(name)[rows])
+                                         for name, dtype in hits.FIELDS))
+        self.hitstart[:] = offsets[:-1]
+        self.root.hitstore = packed
+        return packed
@@ -4,40 +4,85 @@
 
 from __future__ import print_function
 
+import random
+import numpy as np
 import oogenerateEvents as ge
+import npgenerateEvents as ne
+import oogenerateHits as gh
+
+from utils.util import imapBounded
+from utils import instrument
 
 class particleController:
     """ 
     controller for multiple events 
     all plotting is event controlled
+    engine = 'oo' builds events out of Particle/Hit objects (oogenerateEvents),
+    engine = 'numpy' builds columnar events (npgenerateEvents), equivalent is
+    passed on to the numpy engine to reproduce the object path random draws
+    with a seed (or a numpy RandomState rng to draw one from) every event is
+    drawn from its own random state seeded by eventSeed, otherwise events use
+    the global random state
     """
-    def __init__(self):
+    def __init__(self, engine = 'oo', equivalent = False):
         """ controller constructor """
+        self.engine = engine
+        self.equivalent = equivalent
         self.eventids = [0]
 
         self.events = []
         self.particles = []
-        self.hits = []
+        self.hits = gh.HitCollection()
 
     ##############################################################################
     ##################            EVENT METHODS           ########################
     ##############################################################################
-    def generateEvent(self, numparticles, detrad = range(1000, 8001, 1000)):
-        """ generate a single event with numparticles particles """
+    def generateEvent(self, numparticles, detrad = range(1000, 8001, 1000), seed = None,
+                      rng = None):
+        """ generate a single event with numparticles particles, if seed is
+            given the event is generated from its own eventSeed """
         eventid = max(self.eventids) + 1
         self.eventids.append(eventid)
-        thise = ge.Event(eventid, detrad) #create event
-        thise.createParticles(numparticles)
-        thise.computeallHits()
-        self.events.append(thise)
-        self.particles.extend(thise.particles)
-        self.hits.extend(thise.hits)
+        thise = _takeStats(_generateEvent((eventid, numparticles, detrad, self.engine,
+                                           self.equivalent, _seedOf(seed, rng))))
+        self.addEvent(thise)
         return thise
 
-    def generateEvents(self, numevents, numparticles, detrad = range(1000, 8001, 1000)):
-        """ generate numevents events with numparticles particles per event """
-        for i in range(0, numevents):
-            self.generateEvent(numparticles, detrad)
+    def generateEvents(self, numevents, numparticles, detrad = range(1000, 8001, 1000),
+                       workers = 1, seed = None, rng = None):
+        """ generate numevents events with numparticles particles per event
+            and keep them in the controller, see iterEvents """
+        for event in self.iterEvents(numevents, numparticles, detrad, workers, seed, rng):
+            self.addEvent(event)
+
+    def iterEvents(self, numevents, numparticles, detrad = range(1000, 8001, 1000),
+                   workers = 1, seed = None, rng = None, first = None):
+        """ generator over numevents new events with numparticles particles per
+            event, in event order. events are not kept by the controller so
+            only a few are in memory at a time. event ids start at first
+            (default after the events generated before).
+            with workers > 1 events are generated in a process pool, at most
+            2*workers ahead of the consumer. every event gets its own seed
+            derived from seed (or one drawn from the numpy RandomState rng)
+            and its event id so the events do not depend on the number of
+            workers """
+        seed = _seedOf(seed, rng)
+        if workers > 1 and seed is None: #forked workers would share random state
+            seed = random.getrandbits(31)
+        if first is None: first = max(self.eventids) + 1
+        eventids = range(first, first + numevents)
+        self.eventids.extend(eventids)
+        args = [(eventid, numparticles, detrad, self.engine, self.equivalent, seed)
+                for eventid in eventids]
+
+        return (_takeStats(event) for event in imapBounded(_generateEvent, args, workers))
+
+    def addEvent(self, event):
+        """ add a generated event to the controller """
+        self.events.append(event)
+        if self.engine == 'oo': #columnar events keep their particles as arrays
+            self.particles.extend(event.particles)
+            self.hits.extend(event.hits)
 
     ##############################################################################
     ################       DATASET GENERATION METHODS        #####################
@@ -52,4 +97,46 @@ class particleController:
 
     def printallHits(self):
         for event in self.events:
-            event.printallHits(dataset = True)
\ No newline at end of file
+            event.printallHits(dataset = True)
+
+def eventSeed(seed, eventid):
+    """ seed of a single event, derived from the dataset seed and event id """
+    return int(np.random.RandomState([seed, eventid]).randint(2**31 - 1))
+
+def eventRandom(seed, eventid, numpy = True):
+    """ random state of a single event, a numpy RandomState or with numpy =
+        False a random.Random, seeded by eventSeed """
+    if numpy:
+        return np.random.RandomState(eventSeed(seed, eventid))
+    return random.Random(eventSeed(seed, eventid))
+
+def _seedOf(seed, rng):
+    """ seed, or one drawn from the numpy RandomState rng if there is none """
+    if seed is None and rng is not None:
+        return int(rng.randint(2**31 - 1))
+    return seed
+
+def _generateEvent(args):
+    """ create and compute a single event, module level so it can run in a
+        process pool. args = (eventid, numparticles, detrad, engine,
+        equivalent, seed) """
+    eventid, numparticles, detrad, engine, equivalent, seed = args
+    rng = None #global random state
+    if seed is not None:
+        rng = eventRandom(seed, eventid, engine == 'numpy' and not equivalent)
+    if engine == 'numpy':
+        thise = ne.Event(eventid, detrad, equivalent, rng) #create event
+    else:
+        thise = ge.Event(eventid, detrad, rng)
+    thise.createParticles(numparticles)
+    thise.computeallHits()
+    if instrument.enabled(): #back to the parent process with the event
+        thise.stats = instrument.take(eventid)
+    return thise
+
+def _takeStats(event):
+    """ merge the instrument stats an event brought back from _generateEvent """
+    if hasattr(event, 'stats'):
+        instrument.merge(event.stats)
+        del event.stats
+    return event
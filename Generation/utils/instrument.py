@@ -0,0 +1,142 @@
+#!/usr/bin/env python2.7
+# instrument.py
+# Thomas Boser
+
+"""
+opt-in timers and counters for the generation and reconstruction stages.
+everything is off until enable() is called, a disabled timer costs one flag
+check per call. stage times and counts are kept per event id (None for
+stages that are not about a single event).
+
+    instrument.enable()
+    ... generate or reconstruct ...
+    instrument.printReport()
+
+build_datasets.py and run.py turn them on with --profile, --cprofile path
+also writes cProfile stats to path.
+
+events generated in a process pool carry their stats back with them (see
+particleController._generateEvent), reconstruction in a pool is timed as a
+whole.
+"""
+
+from __future__ import print_function, division
+
+import sys
+import time
+import cProfile
+import functools
+
+_state = {'enabled': False}
+_times = {} #(eventid, stage): [calls, seconds]
+_counts = {} #(eventid, name): count
+
+def enable():
+    """ start recording timers and counters """
+    _state['enabled'] = True
+
+def disable():
+    """ stop recording, recorded values are kept """
+    _state['enabled'] = False
+
+def enabled():
+    """ whether timers and counters are recorded """
+    return _state['enabled']
+
+def reset():
+    """ forget every recorded value """
+    _times.clear()
+    _counts.clear()
+
+def timed(stage):
+    """ decorator recording the time of every call of a function or method
+        as stage, under the eventid of the object or of the event argument
+        of methods (Event.computeallHits, EventWriter.writeEvent) """
+    def decorate(func):
+        @functools.wraps(func)
+        def timedFunc(*args, **kwargs):
+            if not _state['enabled']:
+                return func(*args, **kwargs)
+            eventid = _eventOf(args)
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                addTime(eventid, stage, time.time() - start)
+        return timedFunc
+    return decorate
+
+def _eventOf(args):
+    """ eventid of the object or of the event given to a method """
+    for arg in args[:2]:
+        if hasattr(arg, 'eventid'): return arg.eventid
+    return None
+
+def addTime(eventid, stage, seconds, calls = 1):
+    """ record seconds spent in stage for event eventid """
+    entry = _times.setdefault((eventid, stage), [0, 0.])
+    entry[0] += calls
+    entry[1] += seconds
+
+def count(eventid, name, n = 1):
+    """ add n to counter name of event eventid, if enabled """
+    if _state['enabled']:
+        _counts[(eventid, name)] = _counts.get((eventid, name), 0) + n
+
+def take(eventid):
+    """ remove and return the values recorded for event eventid, to be
+        given to merge in another process """
+    times = dict((key, _times.pop(key)) for key in list(_times) if key[0] == eventid)
+    counts = dict((key, _counts.pop(key)) for key in list(_counts) if key[0] == eventid)
+    return times, counts
+
+def merge(stats):
+    """ add values returned by take """
+    times, counts = stats
+    for (eventid, stage), (calls, seconds) in times.items():
+        addTime(eventid, stage, seconds, calls)
+    for key, n in counts.items():
+        _counts[key] = _counts.get(key, 0) + n
+
+def report():
+    """ recorded values as {eventid: {'times': {stage: (calls, seconds)},
+        'counts': {name: count}}} """
+    events = {}
+    for (eventid, stage), (calls, seconds) in _times.items():
+        events.setdefault(eventid, {'times': {}, 'counts': {}})['times'][stage] = (calls, seconds)
+    for (eventid, name), n in _counts.items():
+        events.setdefault(eventid, {'times': {}, 'counts': {}})['counts'][name] = n
+    return events
+
+def printReport(f = sys.stderr):
+    """ print the time of every stage and every counter summed over events """
+    times, counts, events = {}, {}, set()
+    for (eventid, stage), (calls, seconds) in _times.items():
+        total = times.setdefault(stage, [0, 0.])
+        total[0] += calls
+        total[1] += seconds
+        if eventid is not None: events.add(eventid)
+    for (eventid, name), n in _counts.items():
+        counts[name] = counts.get(name, 0) + n
+        if eventid is not None: events.add(eventid)
+    print("%-28s %8s %10s %12s" % ("stage", "calls", "seconds", "s/event"), file=f)
+    for stage, (calls, seconds) in sorted(times.items(), key=lambda item: -item[1][1]):
+        print("%-28s %8d %10.3f %12.5f" % (stage, calls, seconds, seconds / max(len(events), 1)),
+              file=f)
+    for name, n in sorted(counts.items()):
+        print("%-28s %8d" % (name, n), file=f)
+
+def startProfile(path):
+    """ start cProfile if path (where stopProfile writes the stats) is given,
+        returns the profile for stopProfile """
+    if path is None: return None
+    profile = cProfile.Profile()
+    profile.enable()
+    return profile
+
+def stopProfile(profile, path):
+    """ stop a profile from startProfile and dump its stats to path, they can
+        be read with pstats or snakeviz """
+    if profile is None: return
+    profile.disable()
+    profile.dump_stats(path)
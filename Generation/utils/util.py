@@ -6,6 +6,11 @@
 storage for utility functions used in many files
 """
 
+import random
+import threading
+import multiprocessing
+import numpy as np
+
 from math import sqrt
 
 def pt_dist(p1, p2): 
@@ -32,3 +37,316 @@ def circ_intersect(v0, v1, r0, r1):
     y3n = v2y + h*(v1[0] - v0[0])/dist
 
     return [[x3p, y3p], [x3n, y3n]]
+
+##############################################################################
+##################          ARRAY (BATCHED) VERSIONS         #################
+##############################################################################
+# the functions below work on numpy arrays of N particles against M detectors
+# (centered at the origin). squares are taken with pow like the scalar
+# versions above so both give the same points.
+
+def sq(v):
+    """ v**2 through pow, same rounding as ** on python floats """
+    return np.power(v, 2.)
+
+def pt_dist_arr(p1, p2):
+    """ distance between arrays of points, last axis is (x, y) """
+    p1 = np.asarray(p1, dtype=np.float64)
+    p2 = np.asarray(p2, dtype=np.float64)
+    return np.sqrt(sq(p1[..., 0] - p2[..., 0]) + sq(p1[..., 1] - p2[..., 1]))
+
+def circ_intersect_arr(centers, radii, detrad):
+    """ intersection points of N circles (centers (N, 2), radii (N,)) with M
+        detectors of radius detrad (M,) centered at the origin. returns the
+        points as an (N, M, 2, 2) array (pair of [x, y] like circ_intersect)
+        and an (N, M) mask that is False where circ_intersect returns False """
+    centers = np.asarray(centers, dtype=np.float64)
+    cx = centers[:, 0, np.newaxis]
+    cy = centers[:, 1, np.newaxis]
+    r1 = np.asarray(radii, dtype=np.float64)[:, np.newaxis]
+    r0 = np.asarray(detrad, dtype=np.float64)[np.newaxis, :]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dist = np.sqrt(sq(cx) + sq(cy))
+        valid = ~((dist > (r0 + r1)) | (dist < np.abs(r0 - r1)) | (dist == 0))
+
+        a = (sq(r0) - sq(r1) + sq(dist)) / (2*dist)
+        h = np.sqrt(sq(r0) - sq(a))
+        v2x = a*cx/dist
+        v2y = a*cy/dist
+
+        pts = np.empty(valid.shape + (2, 2))
+        pts[..., 0, 0] = v2x + h*cy/dist
+        pts[..., 0, 1] = v2y - h*cx/dist
+        pts[..., 1, 0] = v2x - h*cy/dist
+        pts[..., 1, 1] = v2y + h*cx/dist
+    return pts, valid & np.isfinite(h)
+
+def line_intersect_arr(vertices, angles, detrad):
+    """ points at distance detrad (M,) from N vertices (N, 2) in direction
+        angles (N,), the straight line estimate of Particle.getIntersects.
+        returns an (N, M, 2) array """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    angles = np.asarray(angles, dtype=np.float64)[:, np.newaxis]
+    r0 = np.asarray(detrad, dtype=np.float64)[np.newaxis, :]
+    pts = np.empty((len(vertices), r0.shape[1], 2))
+    pts[..., 0] = r0*np.cos(angles) + vertices[:, 0, np.newaxis]
+    pts[..., 1] = r0*np.sin(angles) + vertices[:, 1, np.newaxis]
+    return pts
+
+def closest_intersect_arr(pts, ref):
+    """ pick, out of each (2, 2) pair in pts (N, M, 2, 2), the point closest
+        to ref (N, M, 2). ties keep the first point, like getIntersects """
+    ref = ref[..., np.newaxis, :]
+    with np.errstate(invalid='ignore'):
+        flag = pt_dist_arr(pts[..., 1, :], ref[..., 0, :]) < \
+               pt_dist_arr(pts[..., 0, :], ref[..., 0, :])
+    return np.where(flag[..., np.newaxis], pts[..., 1, :], pts[..., 0, :])
+
+def helix_intersect_arr(vertices, mangle, charge, detrad, magfield = 1):
+    """ hits of N particles with M detectors as computed one at a time by
+        Particle.getIntersects. vertices (N, 2), mangle (N, 3) holding
+        momentum, theta, phi and charge (N,). charged particles follow their
+        helix circle, neutral ones the straight line. returns (N, M, 2)
+        points and an (N, M) mask of the pairs that produce a hit """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    mangle = np.asarray(mangle, dtype=np.float64)
+    charge = np.asarray(charge)
+    charged = charge != 0
+
+    m_intersect = line_intersect_arr(vertices, mangle[:, 0], detrad)
+
+    radii = np.abs(mangle[:, 0] / np.where(charged, charge*magfield, 1))
+    centers = np.column_stack((vertices[:, 0] + radii*np.sin(mangle[:, 2]),
+                               vertices[:, 1] + radii*np.cos(mangle[:, 2])))
+    pts, valid = circ_intersect_arr(centers, radii, detrad)
+
+    hits = np.where(charged[:, np.newaxis, np.newaxis],
+                    closest_intersect_arr(pts, m_intersect), m_intersect)
+    mask = np.where(charged[:, np.newaxis], valid, True)
+    return hits, mask
+
+def imapBounded(func, args, workers, ahead = 2):
+    """ generator over func(arg) for every arg of the iterable args, in order.
+        with workers > 1 the calls run in a process pool that is handed new
+        args only while fewer than ahead*workers results are waiting, so
+        neither args nor results pile up in memory. func must be a module
+        level function """
+    if workers <= 1:
+        for arg in args:
+            yield func(arg)
+        return
+
+    inflight = threading.Semaphore(ahead*workers)
+    stop = []
+    def feed():
+        """ hand out work only while few results are waiting """
+        for arg in args:
+            inflight.acquire()
+            if stop: return
+            yield arg
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        for result in pool.imap(func, feed()): #results in order
+            inflight.release()
+            yield result
+    finally:
+        stop.append(True)
+        inflight.release() #wake the feeder if it is waiting
+        pool.terminate()
+        pool.join()
+
+class BarcodeAllocator:
+    """ issues particle and hit barcodes. the next free barcodes are kept as
+        high-water marks, so issuing a batch costs only the size of the batch
+        whatever was issued before. every batch is a random permutation of
+        the next free barcodes, allocators started at disjoint ranges (one
+        per worker) never issue the same barcode """
+    def __init__(self, pfirst = 1, hfirst = 1, equivalent = False, rng = None):
+        """ allocator constructor, pfirst and hfirst are the first barcodes.
+            batches are permuted with rng, a numpy RandomState. with
+            equivalent = True rng is a random.Random shuffling the batches
+            like oogenerateEvents.Event. rng defaults to the global state of
+            numpy or random """
+        self.nextp = pfirst
+        self.nexth = hfirst
+        self.equivalent = equivalent
+        if rng is None: rng = random if equivalent else np.random
+        self.rng = rng
+
+    def issue(self, n, hitsper):
+        """ returns n shuffled particle barcodes and n*hitsper shuffled hit
+            barcodes following the ones already issued, as int64 arrays """
+        pbc = self._permutation(self.nextp, n)
+        hbc = self._permutation(self.nexth, n*hitsper)
+        self.nextp += n
+        self.nexth += n*hitsper
+        return pbc, hbc
+
+    def issueHits(self, n):
+        """ returns n shuffled hit barcodes following the ones already issued,
+            for hits with detectors added after their particles """
+        hbc = self._permutation(self.nexth, n)
+        self.nexth += n
+        return hbc
+
+    def _permutation(self, first, n):
+        """ first, ..., first+n-1 in random order """
+        if self.equivalent:
+            values = list(range(first, first + n))
+            self.rng.shuffle(values)
+            return np.array(values, dtype=np.int64)
+        return self.rng.permutation(n).astype(np.int64) + first
+
+class LayerCache:
+    """ hits of the particles of an event with every detector layer, one
+        column per detector radius holding the x, y (nan where the particle
+        misses the layer) and hit barcode of every particle. compute(r, start)
+        given to column and stack gives the column of radius r for the
+        particles from start on, it is called once per layer and only again
+        for particles added since, so adding a layer computes only that
+        column and removing one only drops it """
+    def __init__(self):
+        """ empty cache constructor """
+        self.layers = {} #radius: (x, y, hbc)
+        self.later = {} #radius: hit barcodes of a layer added after the particles
+
+    def __getstate__(self):
+        """ pickled without the columns, they are computed again if needed,
+            so events sent back from a process pool stay small """
+        return {'layers': {}, 'later': self.later}
+
+    def column(self, r, n, compute):
+        """ x, y and hit barcodes of the first n particles with layer r """
+        if r in self.layers: x, y, hbc = self.layers[r]
+        else: x, y, hbc = np.zeros(0), np.zeros(0), np.zeros(0, dtype=np.int64)
+        if len(x) < n:
+            new = compute(r, len(x))
+            x, y, hbc = [np.concatenate((old, part)) for old, part in zip((x, y, hbc), new)]
+            self.layers[r] = (x, y, hbc)
+        return x[:n], y[:n], hbc[:n]
+
+    def stack(self, radii, n, compute):
+        """ (n, len(radii)) x, y and hit barcodes of the first n particles
+            with the layers radii """
+        columns = [self.column(r, n, compute) for r in radii]
+        if not columns:
+            return np.zeros((n, 0)), np.zeros((n, 0)), np.zeros((n, 0), dtype=np.int64)
+        return tuple(np.column_stack([c[k] for c in columns]) for k in range(3))
+
+    def barcodes(self, r, start, n, hitlayers, reserved, allocator):
+        """ hit barcodes of particles start to start+n with layer r. layers
+            of hitlayers use the barcodes reserved for them with the particles
+            (column i of reserved is layer hitlayers[i]), layers added later
+            get barcodes from allocator (a BarcodeAllocator) once, the same
+            however often the hits are computed """
+        if r in hitlayers:
+            return reserved[start:start + n, hitlayers.index(r)]
+        hbc = self.later.get(r, np.zeros(0, dtype=np.int64))
+        if len(hbc) < start + n:
+            hbc = np.concatenate((hbc, allocator.issueHits(start + n - len(hbc))))
+            self.later[r] = hbc
+        return hbc[start:start + n]
+
+    def drop(self, r):
+        """ forget the column of layer r """
+        self.layers.pop(r, None)
+
+    def clear(self):
+        """ forget every column, barcodes of later layers are kept """
+        self.layers.clear()
+
+    def reset(self):
+        """ forget every column and barcode, for new particles """
+        self.layers.clear()
+        self.later.clear()
+
+    def __contains__(self, r):
+        return r in self.layers
+
+class ColumnStore(object):
+    """ rows stored as one numpy array per field instead of one object per
+        row. FIELDS are the (name, dtype) of the columns, a column may have
+        more than one dimension (a fixed number of values per row). indexing
+        gives view objects (a view holds only its store and row) and slicing
+        gives a store of rows of the same arrays, neither copies anything.
+        adding rows grows the arrays by doubling """
+    FIELDS = ()
+    view = None
+    __slots__ = ('root', 'start', 'size', 'columns')
+
+    def __init__(self, **columns):
+        """ store constructor, columns are optional arrays of all fields """
+        self.root = self
+        self.start = 0
+        self.size = len(list(columns.values())[0]) if columns else 0
+        self.columns = dict((name, np.asarray(columns.get(name, np.zeros(self.size)),
+                                              dtype=dtype))
+                            for name, dtype in self.FIELDS)
+
+    def column(self, name):
+        """ array of field name for the rows of this store """
+        return self.root.columns[name][self.start:self.start + self.size]
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, i):
+        """ view of row i, or a store of the rows of a slice """
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self.size)
+            if step != 1: raise ValueError("slices must be contiguous")
+            part = type(self).__new__(type(self))
+            part.root = self.root
+            part.start = self.start + start
+            part.size = max(stop - start, 0)
+            part.columns = None
+            return part
+        if i < 0: i += self.size
+        if not 0 <= i < self.size: raise IndexError("index out of range")
+        row = self.view.__new__(self.view)
+        row.store = self.root
+        row.index = self.start + i
+        return row
+
+    def __iter__(self):
+        for i in range(self.size):
+            yield self[i]
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def add(self, **values):
+        """ add a single row of field values, returns its view """
+        self._reserve(self.size + 1)
+        for name, value in values.items():
+            self.columns[name][self.size] = value
+        self.size += 1
+        return self[self.size - 1]
+
+    def extend(self, rows):
+        """ add all rows of another store of the same fields """
+        n = len(rows)
+        self._reserve(self.size + n)
+        for name, dtype in self.FIELDS:
+            self.columns[name][self.size:self.size + n] = rows.column(name)
+        self.size += n
+
+    def clear(self):
+        """ delete every row, slices taken before are no longer valid """
+        self._reserve(0)
+        self.size = 0
+
+    def _reserve(self, n):
+        """ make room for n rows, only the store owning the arrays can grow """
+        if self.root is not self:
+            raise ValueError("only a whole %s can be added to" % type(self).__name__)
+        have = len(self.columns[self.FIELDS[0][0]])
+        if n <= have: return
+        capacity = max(n, 2*have, 16)
+        for name, dtype in self.FIELDS:
+            old = self.columns[name]
+            column = np.zeros((capacity,) + old.shape[1:], dtype=dtype)
+            column[:self.size] = old[:self.size]
+            self.columns[name] = column
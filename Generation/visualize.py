@@ -0,0 +1,84 @@
+#!/usr/bin/env python2.7
+# visualize.py
+# Thomas Boser
+
+"""
+Plotting of events, particles, hits and detectors. This is the only module
+importing matplotlib and the plot methods of the other modules import it
+when they are called, so generating and reconstructing without plotting
+never loads matplotlib.
+
+whole events are drawn from arrays with one artist per kind of thing (one
+scatter for all hits, one LineCollection for all track joins, one
+PatchCollection for all detectors), sample picks a subset of the particles
+of big events.
+"""
+
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib.patches as patches
+
+from matplotlib.colors import to_rgba_array
+from matplotlib.collections import LineCollection, PatchCollection
+
+COLORS = 'bgrcmyk' #track colors, picked by particle barcode
+_RGBA = to_rgba_array(list(COLORS)) #converted once, not once per point
+
+def points(x, y, color = None):
+    """ plot points (scalars or arrays of coordinates) """
+    if color is None: plt.scatter(x, y)
+    else: plt.scatter(x, y, c=color)
+
+def segment(start, end, color = None):
+    """ plot a line from point start to point end """
+    plt.plot((start[0], end[0]), (start[1], end[1]), color = color)
+
+def circle(center, radius):
+    """ plot an unfilled circle """
+    plt.gca().add_patch(patches.Circle((center[0], center[1]), radius, fill = False))
+
+def tracks(vx, vy, x, y, offsets, colors = None):
+    """ plot every particle as the line from its vertex (vx[i], vy[i])
+        through its hits (x, y)[offsets[i]:offsets[i+1]], in one
+        LineCollection """
+    nhits = np.diff(offsets)
+    has = nhits > 0
+    px = np.empty(len(x))
+    py = np.empty(len(y))
+    px[1:], py[1:] = x[:-1], y[:-1] #segments start at the previous hit
+    px[offsets[:-1][has]], py[offsets[:-1][has]] = vx[has], vy[has] #or at the vertex
+    segments = np.stack((np.column_stack((px, py)), np.column_stack((x, y))), axis=1)
+    if colors is not None: colors = np.repeat(colors, nhits, axis=0)
+    plt.gca().add_collection(LineCollection(segments, colors=colors))
+    plt.gca().autoscale_view()
+
+def circles(radii, center = (0, 0)):
+    """ plot unfilled circles of radii around center, in one PatchCollection """
+    plt.gca().add_collection(PatchCollection([patches.Circle(center, r) for r in radii],
+                                             facecolor='none', edgecolor='k'))
+    plt.gca().autoscale_view()
+
+def colorsOf(pbc):
+    """ rgba track color of every particle barcode """
+    return _RGBA[np.asarray(pbc) % len(COLORS)]
+
+def sample(n, limit = None):
+    """ indices of at most limit of n particles, evenly spread, all of them
+        if limit is None """
+    if limit is None or n <= limit: return np.arange(n)
+    return np.unique(np.linspace(0, n - 1, limit).astype(np.int64))
+
+def sampleHits(offsets, index):
+    """ offsets of the hits of the particles index and the rows of those hits
+        in the arrays offsets refers to """
+    nhits = np.diff(offsets)[index]
+    sub = np.zeros(len(index) + 1, dtype=np.int64)
+    np.cumsum(nhits, out=sub[1:])
+    rows = np.repeat(offsets[:-1][index] - sub[:-1], nhits) + np.arange(sub[-1])
+    return sub, rows
+
+def show():
+    """ show the current figure, origin in green and equal axes """
+    plt.scatter(0, 0, c='g') #always plot origin in green
+    plt.gca().set_aspect('equal', adjustable='box')
+    plt.show()
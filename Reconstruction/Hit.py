@@ -10,16 +10,32 @@ hit barcode, particle barcode, [ local hit x,y ] , [ local error ex, ey ], [ glo
 
 from __future__ import print_function
 
+import sys
 import math
 import numpy as np
-import matplotlib.pyplot as plt
+import Generation.oogenerateHits as gh
+
+class Hit(object):
+    """ a single hit, a view of one row of a HitCollection """
+    __slots__ = ('store', 'index')
 
-class Hit:
-    """ hit constructor """
     def __init__(self, hbc, point, detpos=0):
-        self.hbc = int(hbc)
-        self.lhit = point
-        self.detpos = detpos #to speed up certain processes
+        """ hit constructor, a hit made on its own gets a collection of its own """
+        self.store = HitCollection(hbc=[hbc], x=[point[0]], y=[point[1]], detpos=[detpos])
+        self.index = 0
+
+    hbc = property(lambda self: int(self.store.hbc[self.index]))
+    eid = property(lambda self: int(self.store.eid[self.index]))
+    detpos = property(lambda self: int(self.store.detpos[self.index]))
+    lhit = property(lambda self: [float(self.store.x[self.index]),
+                                  float(self.store.y[self.index])])
+
+    def __eq__(self, other):
+        return (isinstance(other, Hit) and self.store is other.store and
+                self.index == other.index)
+
+    def __ne__(self, other):
+        return not self == other
 
     def __str__(self):
         """ overload print operator """
@@ -35,9 +51,21 @@ class Hit:
 
     def plotHit(self):
         """ plot a hit (single point) to plt figure """
-        plt.scatter(self.lhit[0], self.lhit[1])
+        import Generation.visualize as vis #loads matplotlib
+        vis.points(self.lhit[0], self.lhit[1])
 
     def printHit(self, dataset = False):
         """ print hit to stdout """
-        print(self.hbc, ',', list(self.lhit), sep='')
+        print(self.hbc, ',', self.lhit, sep='')
+
+class HitCollection(gh.HitCollection):
+    """ reconstruction hits (hbc, x, y, detpos and eid arrays, pbc is unused)
+        stored like Generation.oogenerateHits.HitCollection, indexing gives
+        reconstruction Hit views """
+    view = Hit
+    __slots__ = ()
 
+    def printHits(self, dataset = False):
+        """ print all hits to stdout, in the Hit.printHit format """
+        sys.stdout.write(''.join('%d,%r\n' % (hbc, [x, y]) for hbc, x, y in
+                                 zip(self.hbc.tolist(), self.x.tolist(), self.y.tolist())))
@@ -14,13 +14,12 @@ import random
 import math
 import Hit as gh
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
 
 class Particle:
     """ particle constructor """
-    def __init__(self, barcode):
+    def __init__(self, barcode, eventid = 0):
         self.barcode = barcode
+        self.eid = eventid
         self.vertices = [0, 0] #we will assume particle originates from (0, 0)
 
         self.hits = []
@@ -34,18 +33,18 @@ class Particle:
 
     def plotOrigin(self):
         """ plot the origin point for the particle """
-        plt.scatter(self.vertices[0], self.vertices[1], c='r')
+        import Generation.visualize as vis #loads matplotlib
+        vis.points(self.vertices[0], self.vertices[1], 'r')
 
 
     def plotJoins(self):
         """ plot all hits joined by a line """
+        import Generation.visualize as vis #loads matplotlib
         col = random.choice('bgrcmyk') #chose random color
         #self.hits.sort(key=lambda x: x.detpos)
         origin = self.vertices
         for hit in self.hits:
-            plt.plot((origin[0], hit.lhit[0]),
-                     (origin[1], hit.lhit[1]),
-                      color = col)
+            vis.segment(origin, hit.lhit, col)
             origin = hit.lhit
 
     def plotHits(self):
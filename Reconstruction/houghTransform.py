@@ -0,0 +1,289 @@
+#!/usr/bin/env python2.7
+# houghTransform.py
+# Thomas Boser
+
+"""
+Hough transform track finder. generated particles travel on circles through
+the origin, a track is described by its initial direction phi0 and signed
+curvature k = +-1/radius, and a hit at (r, phi) lies on the track if
+
+    phi = phi0 + arcsin(k*r/2)
+
+tracks are searched in the plane of k and the phi they have at rref, halfway
+out, where the curves of the hits of a track spread the least. only the hits
+of the vote layers halfway out take part, the others are picked up by the
+fit.
+
+1. every hit votes for the cells of a coarse (ncurv, nphi) grid its curve
+   goes through, all votes are counted at once in a dense accumulator of
+   hits per cell and layer. cells missing a vote layer hold no track and
+   are dropped
+2. cells with more than crowd (default one) hits on a layer are split in
+   four and the votes of their hits sorted into the quarters, again and
+   again until the cells are about as narrow as a hit is precise. cells of
+   dense events hold hits of other tracks by chance, a cell is searched
+   as soon as it is down to crowd hits per layer
+3. in such a cell the circle through the origin and a hit of the first and
+   of the last vote layer must pass within 2*pad of a hit on every other
+   vote layer to become a candidate, random hits rarely do
+4. the closest hit in phi within tol on every layer is assigned to each
+   candidate, which is refitted (Gauss-Newton) and reassigned
+5. hits claimed by several candidates go to the one with the most hits
+   (smallest residual on ties), candidates left with fewer than minhits
+   hits are dropped
+
+the coarse grid is fixed, its votes grow with the hits. the split cells are
+the ones a track or hits of several tracks go through, a dense event has
+more of the latter: twice the particles take about four times as long to
+refine. a level that would hold more than cells votes is refined half of
+its cells at a time so memory stays bounded.
+
+the coarse cells of a dense event hold far more votes of other tracks than
+of a track (about 185 against 5 at 5000 particles), so the local maxima of
+the accumulator are not where the tracks are and every cell with all vote
+layers is refined instead. the refinement needs votes in proportion to the
+square of the hits, with a larger factor than the seeds of followTracks:
+this finder is 50 to 100 times slower than followTracks.
+"""
+
+from __future__ import division
+
+import numpy as np
+
+from utils.util import PhiIndex, groupmin
+
+def houghTracks(xy, layer, radii, nphi = 256, ncurv = 16, minhits = None, vote = 5,
+                minradius = 4000, tol = 5e-4, pad = 1.5e-5, crowd = 1, fits = 3,
+                cells = 1 << 18, chunk = 4096):
+    """ tracks of one event. xy are the (n, 2) hit positions, layer their
+        index into the sorted detector radii, minhits defaults to one less
+        than the number of layers. the hits of vote layers halfway out vote
+        in an (ncurv, nphi) coarse grid, pad is how far (in phi) a hit may be
+        off the circle of its track and crowd the hits per layer a cell may
+        have to be searched for tracks (see houghCells). cells bounds the
+        votes refined at once and chunk the candidates fitted at once.
+        returns an (ntracks, nlayers) array of hit indices (-1 for none) """
+    nl = len(radii)
+    if nl < 2: #no circle to fit with one layer, every hit is a track
+        return np.arange(len(xy))[:, np.newaxis]
+    if minhits is None: minhits = nl - 1
+    r = np.hypot(xy[:, 0], xy[:, 1])
+    phi = np.arctan2(xy[:, 1], xy[:, 0])
+    vote = min(max(vote, 2), nl)
+    first = (nl - vote) // 2
+    voters = np.nonzero((layer >= first) & (layer < first + vote))[0]
+    k, phi0, found = houghCells(xy[voters], layer[voters] - first, radii[first:first + vote],
+                                nphi, ncurv, 1. / minradius, pad, crowd, cells)
+    tracks = np.full((len(k), nl), -1, dtype=np.int64)
+    tracks[:, first:first + vote] = voters[found]
+
+    byl = [np.nonzero(layer == l)[0] for l in range(nl)]
+    index = [PhiIndex(phi[l], max(1, min(len(l), int(2*np.pi / tol)))) for l in byl]
+    res = np.empty(tracks.shape)
+    for i in range(0, len(k), chunk):
+        part = slice(i, i + chunk)
+        kc, pc = k[part], phi0[part]
+        for j in range(fits + 1):
+            t, e = _assign(kc, pc, radii, byl, index, np.full(nl, tol))
+            if j < fits: kc, pc = _fit(kc, pc, t, r, phi)
+        tracks[part], res[part] = t, e
+    return _resolve(tracks, res, minhits)
+
+def houghCells(xy, layer, radii, nphi, ncurv, kmax, pad, crowd = 1, cells = 1 << 18):
+    """ candidate tracks through the hits xy on the layers of radii, found
+        coarse to fine in the plane of curvature and phi halfway out (see
+        the module docstring). returns the curvature, phi0 and an (ncand,
+        nlayers) array of the hits of every candidate """
+    nl = len(radii)
+    r = np.hypot(xy[:, 0], xy[:, 1])
+    phi = np.arctan2(xy[:, 1], xy[:, 0])
+    rref = (radii[0] + radii[-1]) / 2
+    levels = max(0, int(np.ceil(np.log2(np.pi / (nphi*pad)))))
+    dk, dphi = 2*kmax / ncurv, 2*np.pi / nphi
+    cid, hit, lo, hi = [], [], [], []
+    for i in range(ncurv): #votes of the coarse grid, row by row
+        ea = _shift(phi, r, -kmax + dk*i, rref)
+        eb = _shift(phi, r, -kmax + dk*(i + 1), rref)
+        b0 = np.floor((np.minimum(ea, eb) - pad + np.pi) / dphi).astype(np.int64)
+        n = np.floor((np.maximum(ea, eb) + pad + np.pi) / dphi).astype(np.int64) - b0 + 1
+        h = np.repeat(np.arange(len(r)), n)
+        b = b0[h] + np.arange(len(h)) - np.repeat(np.cumsum(n) - n, n)
+        turn = 2*np.pi*np.floor_divide(b, nphi) #phi of the votes in the range of their cell
+        cid.append(i*nphi + b % nphi)
+        hit.append(h)
+        lo.append(ea[h] - turn)
+        hi.append(eb[h] - turn)
+    cid, hit, lo, hi = np.concatenate(cid), np.concatenate(hit), np.concatenate(lo), np.concatenate(hi)
+    acc = np.bincount(cid*nl + layer[hit], minlength=ncurv*nphi*nl).reshape(ncurv*nphi, nl)
+    keep = acc.min(axis=1) > 0 #cells with votes on every layer
+    sel = np.nonzero(keep[cid])[0]
+    ids = np.nonzero(keep)[0]
+    out = _refine(ids // nphi, ids % nphi, (np.cumsum(keep) - 1)[cid[sel]], hit[sel], lo[sel],
+                  hi[sel], xy, r, phi, layer, nl, kmax, rref, dk, dphi, pad, crowd, levels, cells)
+    if len(out) == 0:
+        return np.zeros(0), np.zeros(0), np.zeros((0, nl), dtype=np.int64)
+    k, phi0, tracks = zip(*out)
+    return np.concatenate(k), np.concatenate(phi0), np.concatenate(tracks)
+
+def _refine(ck, cp, cid, hit, ea, eb, xy, r, phi, layer, nl, kmax, rref, dk, dphi, pad,
+            crowd, levels, cells):
+    """ candidates (see houghCells) in the cells (ck, cp) of size (dk,
+        dphi), split at most levels times. hit[i] votes for cell cid[i], its
+        curve has phi ea[i] and eb[i] at rref (unwrapped to the phi range of
+        the cell) at the lower and upper curvature of the cell. if splitting
+        would give more than cells votes the two halves of the cells are
+        refined one after the other. returns a list of (curvature, phi0,
+        hits) of the candidates of every level """
+    out = []
+    for level in range(levels + 1):
+        count = np.bincount(cid*nl + layer[hit], minlength=len(ck)*nl).reshape(len(ck), nl)
+        keep = count.min(axis=1) > 0
+        done = keep if level == levels else keep & (count.max(axis=1) <= crowd)
+        if done.any():
+            out.append(_candidates(ck[done], cp[done], cid, hit, done, xy, r, phi, layer, nl,
+                                   kmax, rref, dk, dphi, pad, crowd))
+        keep &= ~done
+        if level == levels or not keep.any(): break
+        ck, cp = ck[keep], cp[keep]
+        sel = np.nonzero(keep[cid])[0]
+        cid, hit, ea, eb = (np.cumsum(keep) - 1)[cid[sel]], hit[sel], ea[sel], eb[sel]
+        if 2*len(cid) > cells and len(ck) > 1:
+            half = len(ck) // 2
+            for a, b in ((0, half), (half, len(ck))):
+                part = np.nonzero((cid >= a) & (cid < b))[0]
+                out.extend(_refine(ck[a:b], cp[a:b], cid[part] - a, hit[part], ea[part], eb[part],
+                                   xy, r, phi, layer, nl, kmax, rref, dk, dphi, pad, crowd,
+                                   levels - level, cells))
+            return out
+
+        dk, dphi = dk/2, dphi/2 #split every cell in four
+        km = -kmax + dk*(2*ck + 1)
+        em = np.arcsin(km*rref/2)[cid] - np.arcsin(np.clip(km[cid]*r[hit]/2, -1, 1))
+        em = ea + _wrap(phi[hit] + em - ea) #phi at the middle curvature
+        edge = -np.pi + dphi*2*cp[cid] + dphi #between the phi halves
+        near = np.empty((len(cid), 4), dtype=bool) #the four children, by curvature then phi
+        for j, e0, e1 in ((0, ea, em), (1, em, eb)):
+            lo, hi = np.minimum(e0, e1) - pad, np.maximum(e0, e1) + pad
+            near[:, 2*j] = (lo <= edge) & (hi >= edge - dphi)
+            near[:, 2*j + 1] = (hi >= edge) & (lo <= edge + dphi)
+        v, child = np.nonzero(near)
+        upper = child >= 2
+        cid, hit = 4*cid[v] + child, hit[v]
+        ea, eb = np.where(upper, em[v], ea[v]), np.where(upper, eb[v], em[v])
+        ck = (2*ck[:, np.newaxis] + np.array([0, 0, 1, 1])).ravel()
+        cp = (2*cp[:, np.newaxis] + np.array([0, 1, 0, 1])).ravel()
+    return out
+
+def _candidates(ck, cp, cid, hit, done, xy, r, phi, layer, nl, kmax, rref, dk, dphi, pad,
+                crowd, chunk = 1 << 14):
+    """ (curvature, phi0, hits) of the candidates in the cells (ck, cp)
+        selected by done. the crowd hits closest to the cell centre on every
+        layer are tried, chunk cells at a time """
+    k = -kmax + dk*(ck + .5)
+    u = -np.pi + dphi*(cp + .5)
+    sel = np.nonzero(done[cid])[0]
+    c, h = (np.cumsum(done) - 1)[cid[sel]], hit[sel]
+    e = np.abs(_wrap(_shift(phi[h], r[h], k[c], rref) - u[c]))
+    order = np.lexsort((e, layer[h], c))
+    c, h = c[order], h[order]
+    key = c*nl + layer[h]
+    pos = np.arange(len(key))
+    rank = pos - np.maximum.accumulate(np.where(np.r_[True, key[1:] != key[:-1]], pos, 0))
+    near = rank < crowd
+    table = np.full((len(k), nl, crowd), -1, dtype=np.int64)
+    table[c[near], layer[h[near]], rank[near]] = h[near]
+
+    out = [], [], []
+    for i in range(0, len(k), chunk):
+        t = table[i:i + chunk]
+        ha = np.repeat(t[:, 0], crowd, axis=1) #every pair of the first and last layer
+        hb = np.tile(t[:, -1], (1, crowd))
+        pk, pphi0 = _circle(xy[ha], xy[hb])
+        mid = t[:, np.newaxis, 1:-1] #(cells, 1, layers, crowd)
+        q, d = _curve(pk[..., np.newaxis, np.newaxis], pphi0[..., np.newaxis, np.newaxis], r[mid])
+        e = np.where(mid >= 0, np.abs(_wrap(phi[mid] - q)), np.inf)
+        best = np.argmin(e, axis=-1)
+        ok = (ha >= 0) & (hb >= 0) & (np.min(e, axis=-1) <= 2*pad).all(axis=-1)
+        ci, pi = np.nonzero(ok)
+        tracks = np.empty((len(ci), nl), dtype=np.int64)
+        tracks[:, 0], tracks[:, -1] = ha[ci, pi], hb[ci, pi]
+        tracks[:, 1:-1] = mid[ci[:, np.newaxis], 0, np.arange(nl - 2), best[ci, pi]]
+        for o, v in zip(out, (pk[ci, pi], pphi0[ci, pi], tracks)): o.append(v)
+    return tuple(np.concatenate(o) for o in out)
+
+def _shift(phi, r, k, rref):
+    """ phi at rref of the circles of curvature k through the hits (r, phi) """
+    return phi - np.arcsin(np.clip(k*r/2, -1, 1)) + np.arcsin(np.clip(k*rref/2, -1, 1))
+
+def _curve(k, phi0, r):
+    """ phi of the circles (k, phi0) at distance r and d(phi)/dk """
+    s = np.clip(k*r/2, -.999999, .999999)
+    return phi0 + np.arcsin(s), r/2 / np.sqrt(1 - s**2)
+
+def _assign(k, phi0, radii, byl, index, window):
+    """ closest hit in phi on every layer within window[layer] for every
+        track, returns (ntracks, nlayers) hit indices and residuals """
+    tracks = np.full((len(k), len(radii)), -1, dtype=np.int64)
+    res = np.full((len(k), len(radii)), np.inf)
+    for l in range(len(radii)):
+        q, d = _curve(k, phi0, radii[l])
+        hit, res[:, l] = index[l].nearest(_wrap(q), window[l])
+        tracks[:, l] = np.where(hit >= 0, byl[l][np.maximum(hit, 0)], -1)
+    return tracks, res
+
+def _circle(pa, pb):
+    """ (k, phi0) of the circles through the origin and the points pa and
+        pb (arrays of shape (..., 2)) """
+    a2, b2 = (pa**2).sum(axis=-1), (pb**2).sum(axis=-1)
+    det = 2*(pa[..., 0]*pb[..., 1] - pa[..., 1]*pb[..., 0])
+    line = np.abs(det) < 1e-9*a2*b2**.5 #straight track through the origin
+    det = np.where(line, 1, det)
+    cx = (a2*pb[..., 1] - b2*pa[..., 1]) / det
+    cy = (b2*pa[..., 0] - a2*pb[..., 0]) / det
+    phic = np.arctan2(cy, cx)
+    left = _wrap(np.arctan2(pa[..., 1], pa[..., 0]) - phic) > 0
+    k = np.where(line, 0, np.where(left, -1., 1.) / np.maximum(np.hypot(cx, cy), 1e-300))
+    phi0 = np.where(line, np.arctan2(pa[..., 1], pa[..., 0]),
+                    phic + np.where(left, np.pi/2, -np.pi/2))
+    return k, phi0
+
+def _wrap(phi):
+    """ phi wrapped to [-pi, pi) """
+    return (phi + np.pi) % (2*np.pi) - np.pi
+
+def _fit(k, phi0, tracks, r, phi):
+    """ one Gauss-Newton step of (k, phi0) towards the assigned hits """
+    found = tracks >= 0
+    h = np.maximum(tracks, 0)
+    q, d = _curve(k[:, np.newaxis], phi0[:, np.newaxis], r[h])
+    e = np.where(found, _wrap(phi[h] - q), 0)
+    d = np.where(found, d, 0)
+    n = found.sum(axis=1)
+    sd, sdd = d.sum(axis=1), (d*d).sum(axis=1)
+    se, sde = e.sum(axis=1), (d*e).sum(axis=1)
+    det = n*sdd - sd**2
+    ok = (n >= 2) & (np.abs(det) > 1e-12*np.maximum(sdd, 1))
+    det = np.where(ok, det, 1)
+    k = np.where(ok, k + (n*sde - sd*se) / det, k)
+    phi0 = np.where(ok, phi0 + (sdd*se - sd*sde) / det, phi0)
+    return k, phi0
+
+def _resolve(tracks, res, minhits):
+    """ give every hit to the best track claiming it and drop tracks with
+        fewer than minhits hits left """
+    nhits = (tracks >= 0).sum(axis=1)
+    score = np.where(np.isfinite(res), res, 0).sum(axis=1)
+    rank = np.empty(len(tracks), dtype=np.int64)
+    rank[np.lexsort((score, -nhits))] = np.arange(len(tracks))
+
+    ti, li = np.nonzero(tracks >= 0)
+    hits = tracks[ti, li]
+    order = np.lexsort((rank[ti], hits))
+    hits, ti, li = hits[order], ti[order], li[order]
+    best = groupmin(hits, rank[ti])
+    lost = np.ones(len(hits), dtype=bool)
+    lost[best] = False
+    tracks[ti[lost], li[lost]] = -1
+
+    keep = (tracks >= 0).sum(axis=1) >= minhits
+    return tracks[keep][np.argsort(rank[keep])]
@@ -0,0 +1,479 @@
+#!/usr/bin/env python2.7
+# reconstructionController.py
+# Thomas Boser
+
+"""
+controller for track reconstruction. hits are read in as arrays (see
+data_io.loadHits), assigned to detector layers by radius with a binary search
+over the sorted detector radii, and followed layer by layer from the
+innermost detector outwards. every layer keeps its hits binned in phi
+(PhiIndex) so the hits near a predicted point are found by bin lookup
+instead of comparing against every hit in the event.
+
+tracks are predicted one event (eid) at a time:
+1. every hit on the first layer seeds a track
+2. second layer hits near the seed in phi are paired with it. the phi
+   difference of the pair gives the curvature of the circle through the
+   origin and both hits, and so the phi of its third and fourth layer hits
+   (interpolated from a table per event, see _turns). pairs without hits
+   there within seedtol (scaled with the distance from the second layer)
+   are dropped before any candidate is built. the circle through the first
+   three hits of the others predicts the fourth (again within seedtol) and
+   the candidate with the best fourth hit is kept.
+   the pairs are looked for in passes over a growing phi window, starting
+   at a few second layer hits per seed and ending at the window a particle
+   of radius >= minradius can reach. every pass only pairs the seeds left
+   with the hits left between the last window and the new one, so seeds
+   found in a narrow window (and their hits) are not paired again as it
+   grows. until the last pass a seed only takes a candidate whose fourth
+   and fifth hits are within confirm of the prediction, its true pair may
+   still be further out
+3. remaining layers are predicted with the circle through the last three hits
+   (a line if they are collinear), the closest hit in phi within tol is
+   taken, layers without one are skipped
+no hit goes to two tracks, a hit two tracks want goes to the closer one
+
+houghParticles finds the tracks with a Hough transform instead, see
+houghTransform.
+"""
+
+from __future__ import print_function, division
+
+import sys
+import time
+import numpy as np
+import Hit as gh
+import Particle as gp
+import houghTransform as ht
+import Generation.eventWriter as ew
+import Generation.detectorGeometry as dg
+import Analysis.scoring as sc
+import Generation.utils.instrument as instrument
+
+from utils.util import circ_intersect_arr, imapBounded, PhiIndex, groupmin
+
+class reconstructionController:
+    """ controller for hits, detectors and predicted particles """
+    def __init__(self):
+        """ controller constructor """
+        self.clearController()
+
+    ##############################################################################
+    ##################             HIT METHODS            ########################
+    ##############################################################################
+    def addHit(self, hbc, point, eid = 0):
+        """ add a single hit with barcode hbc at point [x, y] """
+        self.addHits([hbc], [point[0]], [point[1]], [eid])
+
+    def addHits(self, hbc, x, y, eid = None):
+        """ add arrays of hits, eid defaults to event 0 """
+        if eid is None: eid = np.zeros(len(hbc), dtype=np.int64)
+        self.hbc = np.concatenate((self.hbc, np.asarray(hbc, dtype=np.int64)))
+        self.x = np.concatenate((self.x, np.asarray(x, dtype=np.float64)))
+        self.y = np.concatenate((self.y, np.asarray(y, dtype=np.float64)))
+        self.eid = np.concatenate((self.eid, np.asarray(eid, dtype=np.int64)))
+        self.detpos = None
+        self.hits = gh.HitCollection()
+
+    @instrument.timed('compHitdet')
+    def compHitdet(self):
+        """ assign every hit to the detector with the closest radius, sets
+            self.detpos (1 based position in the sorted self.geometry) and
+            self.hits """
+        if len(self.geometry) == 0:
+            print("Please add detectors before assigning hits")
+            return
+        self.detpos = self.layerOf(self.x, self.y) + 1
+        self.hits = gh.HitCollection(hbc=self.hbc, x=self.x, y=self.y, eid=self.eid,
+                                     detpos=self.detpos) #views, no per hit objects
+
+    def layerOf(self, x, y):
+        """ index into the sorted detector radii of the detector closest to
+            each point """
+        return self.geometry.layerOf(x, y)
+
+    def printallHits(self):
+        """ print all hits to stdout """
+        self.hits.printHits()
+
+    def clearHits(self):
+        self.hbc = np.zeros(0, dtype=np.int64)
+        self.x = np.zeros(0)
+        self.y = np.zeros(0)
+        self.eid = np.zeros(0, dtype=np.int64)
+        self.detpos = None
+        self.hits = gh.HitCollection()
+
+    ##############################################################################
+    ##################          DETECTOR METHODS          ########################
+    ##############################################################################
+    def addDetector(self, r):
+        """ add detector of radius r to self.geometry """
+        self.geometry.addDetector(r) #duplicates are ignored
+
+    def setGeometry(self, geometry):
+        """ use the detectors of a DetectorGeometry (see
+            Generation.detectorGeometry.loadGeometry) """
+        self.geometry = geometry
+        self.detpos = None
+
+    def clearDetectors(self):
+        """delete every detector in self.geometry """
+        self.geometry.clear()
+        self.detpos = None
+
+    ##############################################################################
+    ##################          PARTICLE METHODS          ########################
+    ##############################################################################
+    @instrument.timed('predictParticles')
+    def predictParticles(self, tol = 5e-4, minradius = 4000, chunk = 2000, workers = 1,
+                         seedtol = 3e-5):
+        """ predict tracks for every event, see module docstring. tol is the
+            largest phi difference (radians) between a predicted point and a
+            hit, seedtol the same for the third and fourth hit of a seed,
+            minradius the smallest particle circle radius looked for, chunk
+            the number of seeds handled at once. with workers > 1 events are
+            reconstructed in a process pool """
+        self._eachEvent(followTracks, dict(tol=tol, minradius=minradius, chunk=chunk,
+                                           seedtol=seedtol), workers)
+
+    @instrument.timed('houghParticles')
+    def houghParticles(self, nphi = 256, ncurv = 16, minhits = None, tol = 5e-4,
+                       minradius = 4000, workers = 1):
+        """ predict tracks for every event with the Hough transform track
+            finder (see houghTransform), nphi and ncurv are the number of
+            phi0 and curvature bins of the coarse accumulator, which is
+            refined where tracks may be (see houghTransform.houghCells) """
+        self._eachEvent(ht.houghTracks, dict(nphi=nphi, ncurv=ncurv, minhits=minhits,
+                                             minradius=minradius, tol=tol), workers)
+
+    def setSoln(self, teid, thits):
+        """ store predicted tracks given per event lists of track event ids
+            and (ntracks, nlayers) arrays of hit indices (-1 for none) """
+        self.particles = []
+        if len(thits) == 0:
+            self.soln = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+                         np.zeros(1, dtype=np.int64))
+            return
+        teid = np.concatenate(teid)
+        thits = np.concatenate(thits)
+        valid = thits >= 0
+        offsets = np.zeros(len(thits) + 1, dtype=np.int64)
+        np.cumsum(valid.sum(axis=1), out=offsets[1:])
+        self.soln = (teid, thits[valid], offsets)
+
+    def makeParticles(self):
+        """ build Particle objects for the predicted tracks in self.particles """
+        teid, hind, offsets = self.soln
+        self.particles = []
+        for i in range(len(teid)):
+            particle = gp.Particle(i + 1, teid[i])
+            for h in hind[offsets[i]:offsets[i+1]]:
+                particle.addHit(self.hits[h])
+            self.particles.append(particle)
+        return self.particles
+
+    def printSoln(self, f = None):
+        """ print predicted tracks in the tracks_soln.csv format to f
+            (default stdout) """
+        if f is None: f = sys.stdout
+        teid, hind, offsets = self.soln
+        f.write(ew.solnLines(teid, self.hbc[hind], offsets))
+
+    @instrument.timed('writeSoln')
+    def writeSoln(self, path):
+        """ write predicted tracks to the file path """
+        with open(path, 'w') as f:
+            self.printSoln(f)
+
+    def solnArrays(self):
+        """ predicted tracks as (eid, hbc, track) arrays with one entry per
+            hit, like Analysis.scoring.loadSoln """
+        teid, hind, offsets = self.soln
+        track = np.repeat(np.arange(len(teid)), np.diff(offsets))
+        return teid[track], self.hbc[hind], track
+
+    @instrument.timed('scoreSoln')
+    def scoreSoln(self, path, verbose = True, events = None):
+        """ score the predicted tracks against the solution file path (the
+            tracks_soln.csv of the dataset), see Analysis.scoring. events =
+            (first, last) scores against the truth of those events only """
+        truth = sc.loadSoln(path)
+        if events is not None:
+            teid, thbc, ttrack = truth
+            keep = (teid >= events[0]) & (teid <= events[1])
+            truth = (teid[keep], thbc[keep], np.unique(ttrack[keep], return_inverse=True)[1])
+        score = sc.scoreSoln(truth, self.solnArrays())
+        if verbose: sc.printScore(score)
+        return score
+
+    ##############################################################################
+    ##################            HELPER METHODS          ########################
+    ##############################################################################
+    def clearController(self):
+        """ clear controller of all values """
+        self.geometry = dg.DetectorGeometry()
+        self.particles = []
+        self.soln = None
+        self.clearHits()
+
+    def _eachEvent(self, find, params, workers = 1):
+        """ run find(xy, layer, radii, **params) on the hits of every event
+            and store the tracks it returns. with workers > 1 the events go
+            to a process pool a few at a time, tracks are kept in event order """
+        if self.detpos is None: self.compHitdet()
+        layer = self.detpos - 1
+        radii = self.geometry.radii
+
+        order = np.argsort(self.eid, kind='mergesort')
+        bounds = np.nonzero(np.diff(self.eid[order]))[0] + 1
+        events = [hind for hind in np.split(order, bounds) if len(hind)]
+        args = ((int(self.eid[hind[0]]), find, np.column_stack((self.x[hind], self.y[hind])),
+                 layer[hind], radii, params) for hind in events)
+        teid, thits = [], []
+        for hind, (tracks, stats) in zip(events, imapBounded(_findTracks, args, workers)):
+            if stats is not None: instrument.merge(stats) #timed in a worker
+            teid.append(np.full(len(tracks), self.eid[hind[0]], dtype=np.int64))
+            instrument.count(int(self.eid[hind[0]]), 'tracks', len(tracks))
+            thits.append(np.where(tracks >= 0, hind[np.maximum(tracks, 0)], -1))
+        self.setSoln(teid, thits)
+
+def _findTracks(args):
+    """ tracks of a single event, module level so it can run in a process
+        pool. args = (eventid, find, xy, layer, radii, params), returns the
+        tracks and the instrument stats of the event (None if disabled) to
+        be merged back in the parent process """
+    eventid, find, xy, layer, radii, params = args
+    start = time.time()
+    tracks = find(xy, layer, radii, **params)
+    if not instrument.enabled(): return tracks, None
+    instrument.addTime(eventid, 'findTracks', time.time() - start)
+    return tracks, instrument.take(eventid)
+
+def followTracks(xy, layer, radii, tol = 5e-4, minradius = 4000, chunk = 2000,
+                 seedtol = 3e-5, confirm = 1e-7, start = 4, grow = 2.):
+    """ tracks of one event found by seeding and following (see module
+        docstring). xy are the (n, 2) hit positions, layer their index into
+        the sorted detector radii. returns an (ntracks, nlayers) array of
+        hit indices (-1 for none), no hit is in two tracks """
+    nl = len(radii)
+    if nl == 0: return np.zeros((0, 0), dtype=np.int64)
+    phi = np.arctan2(xy[:, 1], xy[:, 0])
+    byl = [np.nonzero(layer == k)[0] for k in range(nl)]
+    free = np.ones(len(xy), dtype=bool) #hits no track has taken
+
+    seeds = byl[0]
+    free[seeds] = False
+    tracks = np.full((len(seeds), nl), -1, dtype=np.int64)
+    tracks[:, 0] = seeds
+    pts = np.zeros((len(seeds), 3, 2)) #last three points of every track
+    pts[:, 2] = xy[seeds]
+
+    if nl > 1:
+        window = _reach(radii[1], minradius) - _reach(radii[0], minradius) + tol
+        turns = _turns(radii[:4], minradius)
+        #the first window holds about start second layer hits per seed
+        inner, width = 0., window
+        if nl > 3: width = min(window, 2*np.pi*start / max(len(byl[1]), 1))
+        waiting = np.arange(len(seeds)) #seeds without a second hit yet
+        while len(waiting):
+            last = width >= window
+            if last: inner = 0. #whatever is left looks at the whole window
+            ahead = [byl[k][free[byl[k]]] for k in range(1, min(nl, 5))]
+            index = [PhiIndex(phi[l], _nbins(len(l), seedtol)) for l in ahead]
+            for first in range(0, len(waiting), chunk):
+                rows = waiting[first:first + chunk]
+                qi, cand, cpts, score = _seed(xy, phi, seeds[rows], ahead, index, radii,
+                                              turns, inner, width, seedtol)
+                best = groupmin(qi, score)
+                qi, cand, cpts, score = qi[best], cand[best], cpts[best], score[best]
+                if not last: #narrow windows miss the true pair of most seeds
+                    keep = score <= confirm
+                    if nl > 4:
+                        fifth, res = _extend(cpts, radii[4], index[3], xy, confirm)
+                        keep &= fifth >= 0
+                    qi, cand, cpts, score = qi[keep], cand[keep], cpts[keep], score[keep]
+                keep = _exclusive(cand[:, 1:min(nl, 4)], score, free)
+                tracks[rows[qi[keep]]] = cand[keep]
+                pts[rows[qi[keep]]] = cpts[keep]
+            waiting = waiting[tracks[waiting, 1] < 0]
+            if last: break
+            inner, width = width, min(window, width*grow)
+
+    for k in range(4, nl):
+        ahead = byl[k][free[byl[k]]]
+        q, ok = _predictPhi(pts, radii[k])
+        qi, hit, dphi = PhiIndex(phi[ahead], _nbins(len(ahead), tol)).pairs(q[ok], tol)
+        rows, hit = _assign(np.nonzero(ok)[0][qi], ahead[hit], np.abs(dphi))
+        tracks[rows, k] = hit
+        free[hit] = False
+        found = np.full(len(seeds), -1, dtype=np.int64)
+        found[rows] = hit
+        _push(pts, xy, found)
+
+    return tracks
+
+def _nbins(n, width):
+    """ phi bins of a PhiIndex of n hits queried with windows of about width """
+    return max(1, min(4*n, int(2*np.pi / width)))
+
+def _seed(xy, phi, seeds, ahead, index, radii, turns, inner, width, seedtol):
+    """ candidate seeds: the seeds paired with the second layer hits between
+        inner and width from them in phi, kept where the pair predicts a
+        third and fourth layer hit within seedtol (scaled with the distance
+        from the second layer). ahead are the hits of layers 1 on indexed by
+        index, turns from _turns. returns the seed row of every candidate, its
+        hits (-1 past the fourth), its last three points and its score, the
+        phi difference of its fourth hit from the circle through the others
+        (of its last hit with fewer layers) """
+    nl = len(radii)
+    q = phi[seeds]
+    if inner > 0: #both sides of the seed, grouped by seed like a single window
+        mid, half = (inner + width) / 2, (width - inner) / 2
+        qi, h1, dphi = index[0].pairs(np.column_stack((q - mid, q + mid)).ravel(), half)
+        dphi += np.where(qi % 2, mid, -mid)
+        qi //= 2
+    else:
+        qi, h1, dphi = index[0].pairs(q, width)
+    found = [seeds[qi], ahead[0][h1]]
+    score = np.abs(dphi)
+    for k in range(2, min(nl, 4)): #the pair predicts the curvature
+        within = seedtol*(radii[k] - radii[1]) / (radii[2] - radii[1])
+        pk, hk, res = index[k - 1].pairs(q[qi] + np.interp(dphi, turns[1], turns[k]), within)
+        qi, dphi, score = qi[pk], dphi[pk], np.abs(res) #pairs without a hit there drop out
+        found = [f[pk] for f in found] + [ahead[k - 1][hk]]
+    cand = np.full((len(qi), nl), -1, dtype=np.int64)
+    cpts = np.zeros((len(qi), 3, 2))
+    for k, f in enumerate(found[:3]):
+        cand[:, k] = f
+        _push(cpts, xy, f)
+    if nl > 3: #best fourth hit of the circle through the first three decides
+        fourth, score = _extend(cpts, radii[3], index[2], xy, seedtol)
+        keep = fourth >= 0
+        qi, cand, cpts, score = qi[keep], cand[keep], cpts[keep], score[keep]
+        cand[:, 3] = ahead[2][fourth[keep]]
+        _push(cpts, xy, cand[:, 3])
+    return qi, cand, cpts, score
+
+def _exclusive(hits, score, free):
+    """ which of the candidates with hits (rows, -1 for none) are taken,
+        best score first, so no hit goes to two of them or is not free.
+        the hits of the candidates taken are marked as not free """
+    valid = hits >= 0
+    keep = np.zeros(len(hits), dtype=bool)
+    waiting = ~(valid & ~free[np.maximum(hits, 0)]).any(axis=1)
+    while waiting.any():
+        rows = np.nonzero(waiting)[0]
+        rows = rows[np.argsort(score[rows], kind='mergesort')]
+        claims = hits[rows][valid[rows]]
+        claimer = np.repeat(rows, valid[rows].sum(axis=1))
+        order = np.argsort(claims, kind='mergesort') #best claimer of every hit first
+        first = np.r_[True, claims[order][1:] != claims[order][:-1]]
+        wins = np.bincount(claimer[order][first], minlength=len(hits))
+        won = rows[wins[rows] == valid[rows].sum(axis=1)]
+        keep[won] = True
+        free[hits[won][valid[won]]] = False
+        waiting[won] = False
+        waiting &= ~(valid & ~free[np.maximum(hits, 0)]).any(axis=1)
+    return keep
+
+def _assign(rows, hits, score):
+    """ exclusive matching of (row, hit) pairs: every row gets at most one
+        hit and every hit at most one row, the best score first. rows must
+        be grouped as PhiIndex.pairs returns them """
+    taken = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    while len(rows):
+        best = groupmin(rows, score) #best hit of every row
+        order = np.lexsort((score[best], hits[best]))
+        first = np.r_[True, hits[best][order][1:] != hits[best][order][:-1]]
+        won = best[order[first]] #and best row of every hit
+        taken = np.r_[taken[0], rows[won]], np.r_[taken[1], hits[won]]
+        left = ~np.in1d(rows, rows[won]) & ~np.in1d(hits, hits[won])
+        rows, hits, score = rows[left], hits[left], score[left]
+    return taken
+
+def _reach(r, radius):
+    """ phi turned by a circle of the given radius through the origin when
+        it reaches distance r from the origin """
+    return np.arcsin(min(1., r / (2.*radius)))
+
+def _turns(radii, minradius, n = 4097):
+    """ phi turned from the first layer to every layer of radii by circles
+        through the origin, for n curvatures from -1/minradius to 1/minradius.
+        the turn to the second layer of a pair of hits gives its curvature and
+        so the turn to the later layers by interpolation """
+    k = np.linspace(-1., 1., n) / minradius
+    return [np.arcsin(np.clip(r*k/2, -1, 1)) - np.arcsin(np.clip(radii[0]*k/2, -1, 1))
+            for r in radii]
+
+def _circle3(p1, p2, p3):
+    """ centers and radii of the circles through the rows of p1, p2, p3,
+        line is True where the points are (close to) collinear """
+    ax, ay = p1[:, 0], p1[:, 1]
+    bx, by = p2[:, 0], p2[:, 1]
+    cx, cy = p3[:, 0], p3[:, 1]
+    d = 2*(ax*(by - cy) + bx*(cy - ay) + cx*(ay - by))
+    a2, b2, c2 = ax**2 + ay**2, bx**2 + by**2, cx**2 + cy**2
+    with np.errstate(divide='ignore', invalid='ignore'): #a track of just its seed
+        ux = (a2*(by - cy) + b2*(cy - ay) + c2*(ay - by)) / d
+        uy = (a2*(cx - bx) + b2*(ax - cx) + c2*(bx - ax)) / d
+        centers = np.column_stack((ux, uy))
+        radii = np.hypot(ux - cx, uy - cy)
+        line = ~np.isfinite(radii) | (radii > 1e9)
+    return centers, radii, line
+
+def _predict(pts, r):
+    """ the two points at distance r from the origin on the circle through
+        the three points of every row of pts (n, 3, 2), or on the line
+        through the last two if they are collinear. returns (n, 2, 2) points
+        and an (n, 2) validity mask """
+    centers, radii, line = _circle3(pts[:, 0], pts[:, 1], pts[:, 2])
+    centers[line] = 0
+    radii[line] = 1
+    cpts, valid = circ_intersect_arr(centers, radii, [r])
+    cpts, valid = cpts[:, 0], np.repeat(valid, 2, axis=1)
+
+    #line through the last two points: |p + t*d| = r
+    p = pts[line, 2]
+    d = p - pts[line, 1]
+    with np.errstate(divide='ignore', invalid='ignore'): #no direction, no prediction
+        d /= np.hypot(d[:, 0], d[:, 1])[:, np.newaxis]
+        b = (p*d).sum(axis=1)
+        disc = b**2 - (p**2).sum(axis=1) + r**2
+        root = np.sqrt(disc)
+    for j, t in enumerate((-b + root, -b - root)):
+        cpts[line, j] = p + t[:, np.newaxis]*d
+        valid[line, j] = disc >= 0
+    return cpts, valid
+
+def _predictPhi(pts, r):
+    """ phi of the prediction at distance r from the origin from the last
+        three points of every track, of the two predicted points the one
+        closer in phi to the last point, tracks stay on their side of the
+        circle. returns the phis and where there is a prediction """
+    cpts, valid = _predict(pts, r)
+    last = np.arctan2(pts[:, 2, 1], pts[:, 2, 0])
+    q = np.arctan2(cpts[..., 1], cpts[..., 0])
+    turn = np.abs((q - last[:, np.newaxis] + np.pi) % (2*np.pi) - np.pi)
+    turn[~valid] = np.inf
+    side = np.argmin(turn, axis=1)
+    rows = np.arange(len(pts))
+    return q[rows, side], np.isfinite(turn[rows, side])
+
+def _extend(pts, r, index, xy, tol):
+    """ closest hit of layer radius r (in index) to the prediction from the
+        last three points of every track (see _predictPhi). returns hit
+        indices into the layer (-1 if none within tol) and their phi
+        difference (inf if none) """
+    q, ok = _predictPhi(pts, r)
+    hit, res = index.nearest(np.where(ok, q, 0), tol)
+    hit[~ok] = -1
+    res[~ok] = np.inf
+    return hit, res
+
+def _push(pts, xy, found):
+    """ shift the hits found into the last three points of the tracks """
+    ok = found >= 0
+    pts[ok, 0] = pts[ok, 1]
+    pts[ok, 1] = pts[ok, 2]
+    pts[ok, 2] = xy[found[ok]]
@@ -6,6 +6,8 @@
 storage for utility functions used in many files
 """
 
+import numpy as np
+
 from math import sqrt
 
 def pt_dist(p1, p2): 
@@ -32,3 +34,62 @@ def circ_intersect(v0, v1, r0, r1):
     y3n = v2y + h*(v1[0] - v0[0])/dist
 
     return [[x3p, y3p], [x3n, y3n]]
+
+#shared with generation so both use the same kernel, re-exported for the
+#reconstruction modules
+from Generation.utils.util import circ_intersect_arr, imapBounded
+
+__all__ = ['pt_dist', 'circ_intersect', 'circ_intersect_arr', 'imapBounded',
+           'PhiIndex', 'groupmin']
+
+class PhiIndex:
+    """ hits of one detector layer binned in phi. the hits are stored sorted
+        by phi together with copies shifted by -2pi and +2pi, so the hits in
+        any window of phi (narrower than pi) are one contiguous slice found
+        from the bin boundaries """
+    def __init__(self, phi, nbins):
+        """ index constructor, phi in [-pi, pi] """
+        order = np.argsort(phi)
+        sphi = phi[order]
+        self.index = np.tile(order, 3)
+        self.phi = np.concatenate((sphi - 2*np.pi, sphi, sphi + 2*np.pi))
+        self.width = 2*np.pi / nbins
+        self.nbins = 3*nbins
+        bins = np.clip(((self.phi + 3*np.pi) / self.width).astype(np.int64), 0, self.nbins - 1)
+        self.starts = np.r_[0, np.cumsum(np.bincount(bins, minlength=self.nbins))]
+
+    def pairs(self, q, delta):
+        """ all (query, hit) pairs with |phi[hit] - q[query]| <= delta.
+            returns query indices, hit indices (into the phi given to the
+            constructor) and phi differences """
+        b0 = np.clip(((q - delta + 3*np.pi) / self.width).astype(np.int64), 0, self.nbins - 1)
+        b1 = np.clip(((q + delta + 3*np.pi) / self.width).astype(np.int64), 0, self.nbins - 1)
+        first = self.starts[b0]
+        counts = self.starts[b1 + 1] - first
+        qi = np.repeat(np.arange(len(q)), counts)
+        pos = first[qi] + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        dphi = self.phi[pos] - q[qi]
+        keep = np.abs(dphi) <= delta
+        return qi[keep], self.index[pos[keep]], dphi[keep]
+
+    def nearest(self, q, delta):
+        """ hit closest in phi to every q within delta (-1 if none) and the
+            absolute phi difference (inf if none) """
+        qi, hi, dphi = self.pairs(q, delta)
+        hit = np.full(len(q), -1, dtype=np.int64)
+        res = np.full(len(q), np.inf)
+        best = groupmin(qi, np.abs(dphi))
+        hit[qi[best]] = hi[best]
+        res[qi[best]] = np.abs(dphi[best])
+        return hit, res
+
+def groupmin(key, values):
+    """ position of the first smallest value in every run of equal keys
+        (key must be grouped, as pairs returns it) """
+    if len(key) == 0: return np.zeros(0, dtype=np.int64)
+    starts = np.r_[0, np.nonzero(np.diff(key))[0] + 1]
+    mins = np.minimum.reduceat(values, starts)
+    group = np.cumsum(np.r_[0, np.diff(key) != 0])
+    ismin = np.nonzero(values == mins[group])[0]
+    first = np.r_[True, group[ismin][1:] != group[ismin][:-1]]
+    return ismin[first]
@@ -2,21 +2,221 @@
 # benchmark.py
 # Thomas Boser
 
-import Generation.particleController as pc
+"""
+Benchmarks of the whole pipeline, written as JSON so runs of different
+versions can be compared.
+
+Example usage:
+python2.7 benchmark.py
+python2.7 benchmark.py --particles 1000,10000 --events 2 --detectors 8 --output bench.json
+python2.7 benchmark.py --engine numpy,oo --method follow,hough
+
+every combination of --particles (per event), --events, --detectors (number
+of layers, radii 1000, 2000, ...), --engine and --method is run in a python
+process of its own through these stages:
+
+kernel         the hit kernels on one event worth of random particles:
+               circ_intersect called for every particle and detector, then
+               circ_intersect_arr and helix_intersect_arr on all at once
+               (scalar_seconds, circ_arr_seconds and helix_arr_seconds)
+generate       createParticles of every event
+hits           computeallHits of every event
+write_csv      hits.csv (shuffled), tracks.csv and tracks_soln.csv
+write_columns  binary hit columns (see eventWriter.ColumnWriter)
+load_csv       data_io.loadHits of hits.csv
+load_columns   data_io.loadHits of the columns, read through
+reconstruct    compHitdet and predictParticles or houghParticles
+score          scoring of the prediction against tracks_soln.csv
+
+every stage reports its time, throughput (hits per second, for kernel the
+particle and detector pairs of its one event per second) and the peak
+resident memory of the process once it is done (MB, it never goes down so
+the stage that raised it is the one using the memory).
+"""
+
+from __future__ import print_function, division
+
+import os
+import sys
+import json
 import time
+import shutil
+import platform
+import argparse
+import resource
+import tempfile
+import itertools
+import subprocess
+import numpy as np
+
+import data_io
+import Generation.utils.util as util
+import Generation.eventWriter as ew
+import Generation.oogenerateEvents as ge
+import Generation.npgenerateEvents as ne
+import Generation.particleController as pc
+import Reconstruction.reconstructionController as rc
+
+def peakMemory():
+    """ peak resident memory of this process in MB """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def kernelSeconds(n, detrad, seed = 1):
+    """ seconds of scalar circ_intersect for n random particles and every
+        detector one at a time, and of circ_intersect_arr and
+        helix_intersect_arr for all of them at once """
+    rng = np.random.RandomState(seed)
+    vertices = rng.uniform(-.03, .03, (n, 2))
+    mangle = np.column_stack((rng.uniform(4000, 15000, n), rng.uniform(0, 4, n),
+                              rng.uniform(-4, 4, n)))
+    charge = rng.randint(-1, 2, n)
+    radii = mangle[:, 0]
+    centers = np.column_stack((vertices[:, 0] + radii*np.sin(mangle[:, 2]),
+                               vertices[:, 1] + radii*np.cos(mangle[:, 2])))
+    origin = np.array([0, 0])
+    seconds = {}
+
+    start = time.time()
+    for i in range(n):
+        for r in detrad:
+            util.circ_intersect(origin, centers[i], r, radii[i])
+    seconds['scalar_seconds'] = time.time() - start
+    start = time.time()
+    util.circ_intersect_arr(centers, radii, detrad)
+    seconds['circ_arr_seconds'] = time.time() - start
+    start = time.time()
+    util.helix_intersect_arr(vertices, mangle, charge, detrad)
+    seconds['helix_arr_seconds'] = time.time() - start
+    return seconds
+
+def benchmarkConfig(particles, events, detectors, engine, method, seed = 1):
+    """ run every stage for one configuration in this process, returns the
+        configuration with a list of stage results """
+    detrad = range(1000, 1000*detectors + 1, 1000)
+    stages = []
+    result = {'particles': particles, 'events': events, 'detectors': detectors,
+              'engine': engine, 'method': method, 'seed': seed, 'stages': stages}
+    tmp = tempfile.mkdtemp(prefix='trackml_bench')
+    try:
+        def stage(name, func):
+            """ time func and record it as stage name """
+            start = time.time()
+            value = func()
+            seconds = time.time() - start
+            stages.append({'stage': name, 'seconds': seconds, 'peak_rss_mb': peakMemory()})
+            return value
+
+        kernel = stage('kernel', lambda: kernelSeconds(particles, detrad, seed))
+        stages[-1].update(kernel)
+
+        if engine == 'numpy':
+            evs = [ne.Event(eid, detrad, rng = pc.eventRandom(seed, eid))
+                   for eid in range(1, events + 1)]
+        else:
+            evs = [ge.Event(eid, detrad, pc.eventRandom(seed, eid, numpy = False))
+                   for eid in range(1, events + 1)]
+        stage('generate', lambda: [e.createParticles(particles) for e in evs])
+        stage('hits', lambda: [e.computeallHits() for e in evs])
+        result['hits'] = int(sum(len(e.hitArrays()[0]) for e in evs))
+
+        hitpath = os.path.join(tmp, 'hits.csv')
+        solnpath = os.path.join(tmp, 'tracks_soln.csv')
+        columnpath = os.path.join(tmp, 'columns')
+        def writeCsv():
+            writer = ew.EventWriter(ew.ShuffledWriter(open(hitpath, 'w'), seed = seed),
+                                    open(os.path.join(tmp, 'tracks.csv'), 'w'),
+                                    open(solnpath, 'w'))
+            for e in evs: writer.writeEvent(e)
+            writer.close()
+        def writeColumns():
+            writer = ew.ColumnWriter(columnpath)
+            for e in evs: writer.writeEvent(e)
+            writer.close()
+        stage('write_csv', writeCsv)
+        stage('write_columns', writeColumns)
+        del evs[:]
+
+        hits = stage('load_csv', lambda: data_io.loadHits(hitpath))
+        stage('load_columns', lambda: dict((name, np.array(col)) for name, col in
+                                           data_io.loadHits(columnpath).items()))
+
+        cont = rc.reconstructionController()
+        for r in detrad: cont.addDetector(r)
+        cont.addHits(hits['hbc'], hits['x'], hits['y'], hits['eid'])
+        del hits
+        def reconstruct():
+            cont.compHitdet()
+            if method == 'hough': cont.houghParticles()
+            else: cont.predictParticles()
+        stage('reconstruct', reconstruct)
+        score = stage('score', lambda: cont.scoreSoln(solnpath, verbose = False))
+        result['score'] = score
+        for s in stages: #the kernels run one event, intersecting every particle and detector
+            hits = particles*len(detrad) if s['stage'] == 'kernel' else result['hits']
+            s['hits_per_s'] = hits / s['seconds'] if s['seconds'] > 0 else None
+    finally:
+        shutil.rmtree(tmp)
+    return result
+
+def runConfig(config):
+    """ benchmark one configuration in a new python process so every
+        configuration gets its own peak memory """
+    out = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+                                   '--config', json.dumps(config)])
+    return json.loads(out)
+
+def version():
+    """ git commit of the benchmarked code, None outside of a git checkout """
+    try:
+        with open(os.devnull, 'w') as null:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=null,
+                                           cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def intList(text):
+    """ comma separated ints of a command line value """
+    return [int(v) for v in text.split(',')]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks generation, writing, loading, '
+                                                 'reconstruction and scoring.')
+    parser.add_argument('--particles', default='1000,10000', required=False)
+    parser.add_argument('--events', default='1', required=False)
+    parser.add_argument('--detectors', default='8', required=False)
+    parser.add_argument('--engine', default='numpy', required=False)
+    parser.add_argument('--method', default='follow', required=False)
+    parser.add_argument('--seed', default=1, required=False)
+    parser.add_argument('--output', default=None, required=False)
+    parser.add_argument('--config', default=None, required=False) #one configuration, used by runConfig
+    args = parser.parse_args()
+
+    if args.config is not None:
+        config = json.loads(args.config)
+        print(json.dumps(benchmarkConfig(**config)))
+        exit(0)
+
+    report = {'version': version(), 'python': platform.python_version(),
+              'numpy': np.__version__, 'platform': platform.platform(), 'results': []}
+    for particles, events, detectors, engine, method in itertools.product(
+            intList(args.particles), intList(args.events), intList(args.detectors),
+            args.engine.split(','), args.method.split(',')):
+        result = runConfig({'particles': particles, 'events': events,
+                            'detectors': detectors, 'engine': engine,
+                            'method': method, 'seed': int(args.seed)})
+        report['results'].append(result)
+        for s in result['stages']:
+            print("%d particles x %d events, %d detectors, %s/%s: %-13s %8.3f s %12.0f hits/s %8.1f MB"
+                  % (particles, events, detectors, engine, method, s['stage'], s['seconds'],
+                     s['hits_per_s'] or 0, s['peak_rss_mb']), file=sys.stderr)
+            if s['stage'] == 'kernel':
+                print("    scalar %.3f s, circ_intersect_arr %.3f s, helix_intersect_arr %.3f s"
+                      % (s['scalar_seconds'], s['circ_arr_seconds'], s['helix_arr_seconds']),
+                      file=sys.stderr)
 
-def benchmarkPC(n):
-	cont = pc.particleController()
-	start = time.time()
-	for i in range(1000, 8001, 1000): cont.addDetector(i)
-	cont.createParticles(10000)
-	end = time.time()
-	print n, "particles generated in", end-start, "seconds."
-
-	start = time.time()
-	cont.computeallHits()
-	end = time.time()
-	print "hits for", n, "particles computed in", end-start, "seconds."
-
-n = input("How many particles do you want to generate?: ")
-benchmarkPC(n)
\ No newline at end of file
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
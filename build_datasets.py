@@ -7,13 +7,54 @@ Basic command line program to create datasets.
 
 Example usage:
 python2.7 build_datasets.py --output-dir /path/to/outdir/ --num-events 10 --hits-per-event 10000 
+python2.7 build_datasets.py --output-dir /path/to/outdir/ --num-events 1000 --workers 8 --seed 42
+python2.7 build_datasets.py --output-dir /path/to/outdir/ --num-events 10 --format both
+
+--format columns writes binary hit columns to dataset_trackml/columns/
+instead of the csv files (see Generation/eventWriter.py, data_io.loadColumns)
+--seed makes the dataset reproducible: every event and the hit shuffle get
+random states derived from it, whatever the number of workers. without
+--seed one is picked and printed
+--profile prints the time of every stage and the hit counts when done,
+--cprofile path writes cProfile stats to path (see Generation/utils/instrument.py)
+--detectors takes a geometry file or radii like 1000,2000,3000 (see
+Generation/detectorGeometry.py), the default is 1000 to 8000 in steps of 1000
+--hits-layout events keeps the hits of every event together in hits.csv
+(shuffled within the event) and writes hits.csv.idx, the byte range of every
+event, so single events can be read with data_io.loadEvents or run.py
+--events instead of the whole file. the default, shuffled, mixes all hits
+--events-per-shard n splits the dataset into shards of n events, each a
+directory shard_00000, shard_00001, ... with its own hits, tracks and
+solution files, and writes manifest.json listing the shards with their event
+ranges and row counts. with --workers every worker writes whole shards, no
+merge step follows
+--cache-dir path keeps datasets in a cache (see Generation/datasetCache.py)
+instead of --output-dir, without --seed under the seed picked and printed.
+the same parameters with the same generation code give back the cached
+dataset, its directory is printed. --cache-size (MB, default 4096) bounds
+the cache, least recently used datasets are deleted past it, as are builds
+left unfinished by a killed process once a day old
+
+python2.7 build_datasets.py --cache-dir /path/to/cache --num-events 10 --seed 42
 """
 
+from __future__ import print_function
+
 import os
-import sys
+import json
 import random
 import argparse
+import numpy as np
 import Generation.particleController as pc
+import Generation.eventWriter as ew
+import Generation.detectorGeometry as dg
+import Generation.datasetCache as dc
+import Generation.utils.instrument as instrument
+
+from Generation.utils.util import imapBounded
+
+SHARD_FORMAT = 'shard_%05d'
+MANIFEST = 'manifest.json'
 
 class DatasetGenerator:
     def __init__(self):
@@ -21,18 +62,58 @@ class DatasetGenerator:
         parser.add_argument('--output-dir', default='/', required=False)
         parser.add_argument('--num-events', default=1, required=False)
         parser.add_argument('--hits-per-event', default=1000, required=False)
-        parser.add_argument('--detectors', default=range(1000, 8001, 1000), required=False) #not implmented yet
+        parser.add_argument('--detectors', default=None, required=False)
+        parser.add_argument('--engine', default='numpy', choices=['numpy', 'oo'], required=False)
+        parser.add_argument('--workers', default=1, required=False)
+        parser.add_argument('--seed', default=None, required=False)
+        parser.add_argument('--shuffle-buckets', default=64, required=False)
+        parser.add_argument('--format', default='csv', choices=['csv', 'columns', 'both'],
+                            required=False)
+        parser.add_argument('--hits-layout', default='shuffled', choices=['shuffled', 'events'],
+                            required=False)
+        parser.add_argument('--events-per-shard', default=0, required=False)
+        parser.add_argument('--profile', action='store_true')
+        parser.add_argument('--cprofile', default=None, required=False)
+        parser.add_argument('--cache-dir', default=None, required=False)
+        parser.add_argument('--cache-size', default=4096, required=False)
 
         args = parser.parse_args()
         self.outdir = args.output_dir
         self.numevents = int(args.num_events)
         self.hpe = int(args.hits_per_event)
-        self.detectors = args.detectors
+        self.detectors = range(1000, 8001, 1000)
+        if args.detectors is not None:
+            self.detectors = dg.geometryOf(args.detectors).values
+        self.engine = args.engine
+        self.workers = int(args.workers)
+        self.seed = None if args.seed is None else int(args.seed)
+        self.cachedir = args.cache_dir
+        self.cachesize = int(args.cache_size)*1024*1024
+        self.buckets = int(args.shuffle_buckets)
+        if self.buckets < 1: parser.error('--shuffle-buckets must be at least 1')
+        if self.seed is None: #pick one so the dataset can be made again
+            self.seed = random.SystemRandom().getrandbits(31)
+            print("seed", self.seed)
+        self.format = args.format
+        self.layout = args.hits_layout
+        self.pershard = int(args.events_per_shard)
 
-        self.generateDataset()
+        if args.profile: instrument.enable()
+        profile = instrument.startProfile(args.cprofile)
+        try:
+            self.generateDataset()
+        finally:
+            instrument.stopProfile(profile, args.cprofile)
+            if args.profile: instrument.printReport()
 
     def generateDataset(self):
-        """ create a directory with new dataset based on specs """
+        """ create a directory with new dataset based on specs, or find it in
+            the cache """
+        if self.cachedir is not None:
+            cache = dc.DatasetCache(self.cachedir, self.cachesize)
+            self.outdir = cache.get(self.cacheParams(), self.writeDataset)
+            print("dataset", self.outdir)
+            return
         if self.outdir[-1] != "/": 
             self.outdir += "/"
         self.outdir += "dataset_trackml"
@@ -43,56 +124,81 @@ class DatasetGenerator:
             i += 1
         cmd = "mkdir -p "+ self.outdir
         os.system(cmd)
+        self.writeDataset(self.outdir)
+
+    def cacheParams(self):
+        """ everything the dataset depends on, workers only change how fast it
+            is made """
+        return {'events': self.numevents, 'hits_per_event': self.hpe,
+                'detectors': list(self.detectors), 'engine': self.engine,
+                'seed': self.seed, 'shuffle_buckets': self.buckets,
+                'format': self.format, 'hits_layout': self.layout,
+                'events_per_shard': self.pershard}
+
+    def writeDataset(self, outdir):
+        """ generate the events and write the dataset files to outdir, as
+            shards with a manifest if there are events per shard """
+        if self.pershard <= 0:
+            self.writeEvents(outdir, 1, self.numevents, self.workers, self.seed)
+            return
+        shards = [(self, i, os.path.join(outdir, SHARD_FORMAT % i), first,
+                   min(first + self.pershard - 1, self.numevents))
+                  for i, first in enumerate(range(1, self.numevents + 1, self.pershard))]
+        manifest = dict(self.cacheParams(), shards = [])
+        for shard, stats in imapBounded(_writeShard, shards, self.workers):
+            manifest['shards'].append(shard)
+            for s in stats: instrument.merge(s)
+        with open(os.path.join(outdir, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+
+    def writeEvents(self, outdir, first, numevents, workers, seed):
+        """ generate numevents events from event id first and write their
+            files to outdir with the hits shuffled by seed, returns the number
+            of hit and track rows written (no track rows with only columns) """
+        cont = pc.particleController(self.engine)
+        writers = []
+        csv = columns = None
+        if self.format in ('csv', 'both'):
+            if self.layout == 'events': #grouped by event, with an index
+                hitf = ew.IndexedWriter(open(outdir + "/hits.csv", 'w'),
+                                        open(outdir + "/hits.csv" + ew.INDEX_SUFFIX, 'w'),
+                                        seed)
+            else:
+                hitf = ew.ShuffledWriter(open(outdir + "/hits.csv", 'w'), #shuffled as written
+                                         self.buckets, seed, outdir)
+            truthf = open(outdir + "/tracks.csv", 'w')
+            solnf = open(outdir + "/tracks_soln.csv", 'w')
+            csv = ew.EventWriter(hitf, truthf, solnf)
+            writers.append(csv)
+        if self.format in ('columns', 'both'):
+            columns = ew.ColumnWriter(outdir + "/columns")
+            writers.append(columns)
+        try: #events are written as they come and then dropped
+            for event in cont.iterEvents(numevents, self.hpe, self.detectors,
+                                         workers, self.seed, first = first):
+                for writer in writers: writer.writeEvent(event)
+        finally:
+            for writer in writers: writer.close()
+        if csv is not None: return csv.nhits, csv.ntracks
+        return columns.nrows, 0
+
+def shardSeed(seed, shard):
+    """ seed of the hit shuffle of a single shard, derived from the dataset
+        seed and shard number """
+    return int(np.random.RandomState([seed, shard, 1]).randint(2**31 - 1))
 
-        cont = pc.particleController()
-        cont.generateEvents(self.numevents, self.hpe, self.detectors)
-
-        self.generateHits(cont)
-        self.generateTruths(cont)
-        self.generateSolution(cont)
-
-    def generateHits(self, cont):
-        """ generates the hits.csv file """
-        hitf = self.outdir + "/hits.csv"
-        old = os.dup(1)
-        sys.stdout.flush()
-        os.close(1)
-        os.open(hitf, os.O_WRONLY | os.O_CREAT)
-        cont.printallHits()
-        sys.stdout.flush()
-        os.close(1)
-        os.dup(old)
-        os.close(old)
-
-        lines = open(hitf).readlines()
-        random.shuffle(lines)
-        open(hitf, 'w').writelines(lines)
-
-    def generateTruths(self, cont):
-        """ generates the tracks.csv file """
-        truthf = self.outdir + "/tracks.csv"
-        old = os.dup(1)
-        sys.stdout.flush()
-        os.close(1)
-        os.open(truthf, os.O_WRONLY | os.O_CREAT)
-        cont.printallTruths()
-        sys.stdout.flush()
-        os.close(1)
-        os.dup(old)
-        os.close(old)
-
-    def generateSolution(self, cont):
-        """ generates the tracks_soln.csv file """
-        solnf = self.outdir + "/tracks_soln.csv"
-        old = os.dup(1)
-        sys.stdout.flush()
-        os.close(1)
-        os.open(solnf, os.O_WRONLY | os.O_CREAT)
-        cont.printallSolutions()
-        sys.stdout.flush()
-        os.close(1)
-        os.dup(old)
-        os.close(old)
+def _writeShard(args):
+    """ write a single shard, module level so shards can be written in a
+        process pool. args = (generator, shard number, directory, first
+        event, last event), returns the manifest entry of the shard and the
+        instrument stats of its events """
+    generator, shard, path, first, last = args
+    if not os.path.exists(path): os.makedirs(path)
+    hits, tracks = generator.writeEvents(path, first, last - first + 1, 1,
+                                         shardSeed(generator.seed, shard))
+    stats = [instrument.take(eid) for eid in [None] + range(first, last + 1)]
+    return {'path': os.path.basename(path), 'first_event': first, 'last_event': last,
+            'events': last - first + 1, 'hits': hits, 'tracks': tracks}, stats
 
 if __name__ == '__main__':
-    dg = DatasetGenerator()
\ No newline at end of file
+    generator = DatasetGenerator()
\ No newline at end of file
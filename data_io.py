@@ -4,9 +4,116 @@
 
 from __future__ import print_function
 
+import os
+import numpy as np
+import Generation.eventWriter as ew
+import Generation.utils.instrument as instrument
+
 def printv(verbose, *args): #written to mimic python3 print
     """ toggleable print """
     if verbose:
         for arg in args:
             print(arg, end="")
         print()
+
+def loadColumns(path, columns = None):
+    """ open the binary hit columns in directory path (written by
+        build_datasets.py --format columns) as read only memory maps.
+        returns a dict of column name to array, all columns by default """
+    if columns is None: columns = [name for name, dtype in ew.COLUMNS]
+    return dict((name, np.load(os.path.join(path, name + '.npy'), mmap_mode='r'))
+                for name in columns)
+
+@instrument.timed('loadHits')
+def loadHits(path, chunksize = None):
+    """ read a hits file into arrays in one pass. returns a dict with int64
+        'eid' and 'hbc' and float64 'x' and 'y' arrays.
+        lines are either eid,hbc,x,y (hits.csv, Event.printallHits(dataset =
+        True)) or the bracketed eid,hbc,[x, y]. a directory is read as binary
+        columns (see loadColumns). with chunksize (bytes) the file is read
+        chunk by chunk, see iterHits """
+    if os.path.isdir(path):
+        return loadColumns(path, ['eid', 'hbc', 'x', 'y'])
+    chunks = list(iterHits(path, chunksize))
+    return dict((name, np.concatenate([chunk[name] for chunk in chunks]))
+                for name in HIT_FIELDS)
+
+def iterHits(path, chunksize = 1 << 26):
+    """ generator over the hits in path as dicts of arrays like loadHits,
+        reading about chunksize bytes (whole lines) at a time so files larger
+        than memory can be processed. chunksize = None reads the whole file """
+    with open(path, 'rb') as f:
+        rest = b''
+        while True:
+            block = f.read(chunksize) if chunksize else f.read()
+            if not block: break
+            block = rest + block
+            end = block.rfind(b'\n') + 1
+            if end == 0: #no full line yet
+                rest = block
+                continue
+            rest = block[end:]
+            yield _parseHits(block[:end])
+        if rest.strip():
+            yield _parseHits(rest)
+
+HIT_FIELDS = ('eid', 'hbc', 'x', 'y')
+INDEX_FIELDS = ('eid', 'offset', 'length', 'rows')
+
+def loadIndex(path):
+    """ read the event index of the hits file path (written by
+        build_datasets.py --hits-layout events, see eventWriter.IndexedWriter)
+        into a dict of int64 arrays eid, offset, length and rows """
+    with open(path + ew.INDEX_SUFFIX, 'rb') as f:
+        text = f.read().strip().replace(b'\n', b',')
+    if not text: values = np.zeros((0, len(INDEX_FIELDS)), dtype=np.int64)
+    else: values = np.fromstring(text, dtype=np.int64, sep=',').reshape(-1, len(INDEX_FIELDS))
+    return dict((name, values[:, i]) for i, name in enumerate(INDEX_FIELDS))
+
+@instrument.timed('loadEvents')
+def loadEvents(path, first, last = None, index = None):
+    """ read the hits of events first to last (both included, default only
+        first) from an event grouped hits file into arrays like loadHits.
+        only those events are read, seeking with the index of the file
+        (see loadIndex, given or read) """
+    if last is None: last = first
+    if index is None: index = loadIndex(path)
+    want = np.nonzero((index['eid'] >= first) & (index['eid'] <= last))[0]
+    blocks = []
+    with open(path, 'rb') as f:
+        for i in want.tolist():
+            f.seek(index['offset'][i])
+            blocks.append(f.read(index['length'][i]))
+    return _parseHits(b''.join(blocks))
+
+def _parseHits(text):
+    """ parse whole lines of hits into a dict of arrays. a header line
+        eid,hbc,x,y is skipped, any other line that is not four numbers
+        raises a ValueError naming it """
+    lines = text.translate(None, b'[] \r').strip().split(b'\n')
+    if lines[0] == b','.join(HIT_FIELDS): lines = lines[1:]
+    if lines == [b'']: lines = []
+    tokens = b','.join(lines).split(b',') if lines else []
+    if len(tokens) != 4*len(lines): _badLine(lines)
+    columns = {}
+    for i, name in enumerate(HIT_FIELDS):
+        dtype = np.int64 if name in ('eid', 'hbc') else np.float64
+        #parse each column on its own so the ids never go through float64.
+        #fromstring stops quietly at the first bad token, the trailing 0
+        #makes that show in the count even when it is the last one
+        column = np.fromstring(b','.join(tokens[i::4] + [b'0']), dtype=dtype, sep=',')
+        if len(column) != len(lines) + 1: _badLine(lines)
+        columns[name] = column[:-1]
+    return columns
+
+def _badLine(lines):
+    """ raise a ValueError naming the first line of lines that is not
+        eid,hbc,x,y with integer ids and float coordinates """
+    for line in lines:
+        fields = line.split(b',')
+        try:
+            if len(fields) != 4: raise ValueError
+            int(fields[0]), int(fields[1]), float(fields[2]), float(fields[3])
+        except ValueError:
+            raise ValueError("bad hits line %r, expected eid,hbc,x,y" % line)
+    raise ValueError("bad hits text, expected lines of eid,hbc,x,y")
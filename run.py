@@ -3,18 +3,34 @@
 # Thomas Boser
 
 """
-usage = python2.7 run.py infile outfile
+usage = python2.7 run.py infile outfile [--method follow|hough]
+
+--method hough finds the tracks with a Hough transform (see
+Reconstruction/houghTransform.py), --phi-bins and --curv-bins set the size of
+its coarse accumulator (default 256 x 16), cells of it that tracks may go
+through are refined until they are about as narrow as a hit is precise,
+which makes it 50 to 100 times slower than follow.
+--truth tracks_soln.csv scores the prediction (see Analysis/scoring.py).
+--workers n reconstructs the events in a pool of n processes
+--profile prints the time of every stage when done, --cprofile path writes
+cProfile stats to path (see Generation/utils/instrument.py)
+--detectors takes the geometry the dataset was generated with, a geometry
+file or radii like 1000,2000,3000 (default 1000 to 8000 in steps of 1000)
+--events first or first:last reconstructs only those events, read straight
+from an infile written with build_datasets.py --hits-layout events (through
+its index, see data_io.loadEvents)
 """
 
 from __future__ import print_function
 
 import os
-import sys
 import time
-import particleController as pc
-from data_io import printv
-
-from __future__ import print_function
+import argparse
+import Reconstruction.reconstructionController as rc
+import Generation.detectorGeometry as dg
+import Generation.eventWriter as ew
+import Generation.utils.instrument as instrument
+from data_io import printv, loadHits, loadEvents
 
 start = time.time()
 
@@ -24,35 +40,69 @@ verbose = True
 #main
 if __name__ == "__main__":
 
-    if len(sys.argv) != 3:
-        print("usage: python2.7 run.py infile outfile")
-        exit(1)
+    parser = argparse.ArgumentParser(description='Predicts tracks of a TrackML dataset.')
+    parser.add_argument('infile')
+    parser.add_argument('outfile')
+    parser.add_argument('--method', default='follow', choices=['follow', 'hough'], required=False)
+    parser.add_argument('--phi-bins', default=256, required=False)
+    parser.add_argument('--curv-bins', default=16, required=False)
+    parser.add_argument('--truth', default=None, required=False)
+    parser.add_argument('--workers', default=1, required=False)
+    parser.add_argument('--detectors', default=None, required=False)
+    parser.add_argument('--events', default=None, required=False)
+    parser.add_argument('--profile', action='store_true')
+    parser.add_argument('--cprofile', default=None, required=False)
+    args = parser.parse_args()
+    if args.profile: instrument.enable()
+    profile = instrument.startProfile(args.cprofile)
 
-    infilen = sys.argv[1]
-    outfilen = sys.argv[2]
+    infilen = args.infile
+    outfilen = args.outfile
+    events = None
+    if args.events is not None: #first or first:last
+        events = [int(e) for e in args.events.split(':')]
+        events = (events[0], events[-1])
+        if os.path.isdir(infilen) or not os.path.isfile(infilen + ew.INDEX_SUFFIX):
+            print("--events needs the hits.csv" + ew.INDEX_SUFFIX + " index written next to",
+                  "infile by build_datasets.py --hits-layout events")
+            exit(1)
 
     #try to read from infile
     printv(verbose, "opening infile")
     try:
-        infile = open(infilen, 'r')
+        if events is None: hits = loadHits(infilen) #eid, hbc, x, y arrays
+        else: hits = loadEvents(infilen, events[0], events[1])
     except IOError:
         print("infile could not be opened")
         exit(1)
   
-    #initialize particlecontroller  
-    cont = pc.particleController()
+    #initialize reconstructionController
+    cont = rc.reconstructionController()
 
-    #add hits from infile to particlecontroller
-    for line in infile:
-        line = line.replace(']','').replace('[','')\
-            .replace(' ','').rstrip().split(',')
-        cont.addHit(line[0], [float(line[2]), float(line[3])], line[1])
-    printv(verbose, len(cont.hits)," hits added to controller")
+    #add hits from infile to reconstructionController
+    cont.addHits(hits['hbc'], hits['x'], hits['y'], hits['eid'])
+    printv(verbose, len(hits['hbc'])," hits added to controller")
 
     printv(verbose, "creating detectors, calculating detector interceptions")
-    for i in range(1000, 8001, 1000): cont.addDetector(i) #can change detector params, ex here
+    if args.detectors is not None:
+        cont.setGeometry(dg.geometryOf(args.detectors))
+    else:
+        for i in range(1000, 8001, 1000): cont.addDetector(i) #can change detector params, ex here
 
     cont.compHitdet() #assign detector to hits
-    cont.predictParticles()
+    printv(verbose, "predicting particles")
+    if args.method == 'hough':
+        cont.houghParticles(nphi = int(args.phi_bins), ncurv = int(args.curv_bins),
+                            workers = int(args.workers))
+    else:
+        cont.predictParticles(workers = int(args.workers))
+
+    cont.writeSoln(outfilen)
+    printv(verbose, len(cont.soln[0]), " tracks written to ", outfilen,
+           " in ", time.time() - start, " seconds")
+
+    if args.truth is not None:
+        cont.scoreSoln(args.truth, events = events)
 
-    cont.printSoln()
+    instrument.stopProfile(profile, args.cprofile)
+    if args.profile: instrument.printReport()
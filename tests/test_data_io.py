@@ -0,0 +1,52 @@
+#!/usr/bin/env python2.7
+# test_data_io.py
+# Thomas Boser
+
+"""
+checks of the hits file parsing in data_io.py, run from the repository root
+with python2.7 -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import data_io
+
+class ParseHitsTest(unittest.TestCase):
+    def testFormats(self):
+        """ plain and bracketed lines give the same arrays """
+        for text in [b"1,2,3.5,-4\n1,3,5,6\n", b"1,2,[3.5, -4.0]\n1,3,[5, 6]\n"]:
+            hits = data_io._parseHits(text)
+            self.assertEqual(hits['eid'].tolist(), [1, 1])
+            self.assertEqual(hits['hbc'].tolist(), [2, 3])
+            self.assertEqual(hits['x'].tolist(), [3.5, 5])
+            self.assertEqual(hits['y'].tolist(), [-4, 6])
+
+    def testHeader(self):
+        """ a header line is skipped """
+        hits = data_io._parseHits(b"eid,hbc,x,y\n7,8,1,2\n")
+        self.assertEqual(hits['eid'].tolist(), [7])
+        self.assertEqual(len(data_io._parseHits(b"eid,hbc,x,y\n")['x']), 0)
+
+    def testExactIds(self):
+        """ ids past the float64 mantissa are read exactly """
+        big = 2**53 + 1
+        hits = data_io._parseHits(b"%d,%d,0,0\n" % (big, big + 2))
+        self.assertEqual(hits['eid'].tolist(), [big])
+        self.assertEqual(hits['hbc'].tolist(), [big + 2])
+
+    def testBadLines(self):
+        """ a line that is not eid,hbc,x,y raises naming the line, wherever
+            it is """
+        for bad in [b"1,2,3", b"1,2,3,4,5", b"1,x,3,4", b"1.5,2,3,4", b"1,2,3,4y"]:
+            for text in [bad + b"\n1,2,3,4\n", b"1,2,3,4\n" + bad + b"\n"]:
+                with self.assertRaises(ValueError) as caught:
+                    data_io._parseHits(text)
+                self.assertIn(repr(bad), str(caught.exception))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python2.7
+# test_datasets.py
+# Thomas Boser
+
+"""
+regression checks of build_datasets.py, run from the repository root with
+python2.7 -m unittest discover tests
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import filecmp
+import tempfile
+import unittest
+import subprocess
+
+from StringIO import StringIO
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import Generation.particleController as pc
+import Generation.eventWriter as ew
+import Generation.datasetCache as dc
+
+def buildDataset(outdir, *args):
+    """ run build_datasets.py into outdir, returns the dataset directory """
+    with open(os.devnull, 'w') as null:
+        subprocess.check_call([sys.executable, os.path.join(ROOT, 'build_datasets.py'),
+                               '--output-dir', outdir] + list(args), stdout=null, cwd=ROOT)
+    return os.path.join(outdir, 'dataset_trackml')
+
+def sameTree(a, b):
+    """ whether directories a and b hold the same files with the same bytes """
+    cmp = filecmp.dircmp(a, b)
+    if cmp.left_only or cmp.right_only or cmp.funny_files: return False
+    match, mismatch, errors = filecmp.cmpfiles(a, b, cmp.common_files, shallow=False)
+    return not mismatch and not errors and all(sameTree(os.path.join(a, d), os.path.join(b, d))
+                                               for d in cmp.common_dirs)
+
+class WorkersTest(unittest.TestCase):
+    """ a seeded dataset does not depend on the number of workers """
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='trackml_test')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def checkWorkers(self, *args):
+        args = ('--num-events', '4', '--hits-per-event', '200', '--seed', '11') + args
+        one = buildDataset(os.path.join(self.tmp, 'one'), '--workers', '1', *args)
+        two = buildDataset(os.path.join(self.tmp, 'two'), '--workers', '2', *args)
+        self.assertTrue(sameTree(one, two))
+        return one
+
+    def testNumpy(self):
+        self.checkWorkers('--engine', 'numpy', '--format', 'both')
+
+    def testObjects(self):
+        self.checkWorkers('--engine', 'oo', '--format', 'both')
+
+    def testBuckets(self):
+        with self.assertRaises(ValueError):
+            ew.ShuffledWriter(StringIO(), 0)
+        with open(os.devnull, 'w') as null:
+            code = subprocess.call([sys.executable, os.path.join(ROOT, 'build_datasets.py'),
+                                    '--output-dir', self.tmp, '--seed', '1',
+                                    '--shuffle-buckets', '0'], stdout=null, stderr=null, cwd=ROOT)
+        self.assertEqual(code, 2) #argparse usage error
+        self.assertEqual(os.listdir(self.tmp), [])
+
+    def testShards(self):
+        dataset = self.checkWorkers('--events-per-shard', '3', '--hits-layout', 'events')
+        with open(os.path.join(dataset, 'manifest.json')) as f:
+            shards = json.load(f)['shards']
+        self.assertEqual([(s['path'], s['first_event'], s['last_event'], s['events'])
+                          for s in shards],
+                         [('shard_00000', 1, 3, 3), ('shard_00001', 4, 4, 1)])
+        for shard in shards:
+            path = os.path.join(dataset, shard['path'])
+            with open(os.path.join(path, 'hits.csv')) as f:
+                hits = f.read().splitlines()
+            with open(os.path.join(path, 'tracks.csv')) as f:
+                tracks = f.read().splitlines()
+            self.assertEqual(shard['hits'], len(hits))
+            self.assertEqual(shard['tracks'], len(tracks))
+            eids = set(int(line.split(',', 1)[0]) for line in hits + tracks)
+            self.assertEqual(eids, set(range(shard['first_event'], shard['last_event'] + 1)))
+
+class CacheTest(unittest.TestCase):
+    """ builds left behind by a killed process are cleaned up """
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='trackml_test')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def testStaleBuilds(self):
+        cache = dc.DatasetCache(self.tmp, 1 << 30)
+        old, new = [os.path.join(self.tmp, dc.BUILDING + name) for name in ('old', 'new')]
+        for path in (old, new):
+            os.makedirs(os.path.join(path, 'columns'))
+            with open(os.path.join(path, 'columns', 'x.npy'), 'w') as f: f.write('x')
+        past = time.time() - dc.STALE - 60
+        for p, dirs, files in os.walk(old):
+            for name in [p] + [os.path.join(p, f) for f in files]: os.utime(name, (past, past))
+        cache.evict()
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+
+def eventFiles(cont, *args, **kwargs):
+    """ hits, tracks and solution text of the events of cont.iterEvents """
+    files = [StringIO(), StringIO(), StringIO()]
+    writer = ew.EventWriter(*files)
+    for event in cont.iterEvents(*args, **kwargs): writer.writeEvent(event)
+    return [f.getvalue() for f in files]
+
+class EquivalentTest(unittest.TestCase):
+    """ the numpy engine with equivalent = True draws the events of the oo
+        engine from the same seed """
+    def testSameOutput(self):
+        oo = eventFiles(pc.particleController('oo'), 3, 300, seed = 7)
+        npeq = eventFiles(pc.particleController('numpy', equivalent = True), 3, 300, seed = 7)
+        for name, a, b in zip(('hits', 'tracks', 'solutions'), oo, npeq):
+            self.assertTrue(a, name + ' empty')
+            self.assertEqual(a, b, name + ' differ')
+
+class DetectorTest(unittest.TestCase):
+    """ hits cached per detector layer (LayerCache) give the same hits as
+        computing them again, and adding a detector computes only its layer """
+    def event(self, engine):
+        """ a seeded event of engine with computed hits """
+        event = pc.particleController(engine).generateEvent(200, seed = 5)
+        event.hitArrays()
+        return event
+
+    def hits(self, event):
+        """ copies of the hit arrays of event """
+        return [np.array(a) for a in event.hitArrays()]
+
+    def assertSameHits(self, a, b):
+        for name, x, y in zip(('hbc', 'pbc', 'x', 'y', 'detpos'), a, b):
+            self.assertTrue(np.array_equal(x, y), name + ' differ')
+
+    def checkRecompute(self, engine):
+        event = self.event(engine)
+        before = self.hits(event)
+        event.computeallHits(recompute = True)
+        self.assertSameHits(before, self.hits(event))
+
+    def checkAddDetector(self, engine):
+        event = self.event(engine)
+        computed = []
+        column = event.layers.column
+        def spy(r, n, compute):
+            def counted(r, start):
+                computed.append((r, start))
+                return compute(r, start)
+            return column(r, n, counted)
+        event.layers.column = spy
+        event.addDetector(4500)
+        added = self.hits(event)
+        self.assertEqual(computed, [(4500, 0)])
+        self.assertIn(event.geometry.values.index(4500) + 1, added[4])
+
+    def checkAddRemove(self, engine):
+        event = self.event(engine)
+        before = self.hits(event)
+        event.addDetector(4500)
+        event.hitArrays()
+        event.removeDetector(4500)
+        self.assertSameHits(before, self.hits(event))
+
+    def testNumpyRecompute(self):
+        self.checkRecompute('numpy')
+
+    def testObjectsRecompute(self):
+        self.checkRecompute('oo')
+
+    def testNumpyAddDetector(self):
+        self.checkAddDetector('numpy')
+
+    def testObjectsAddDetector(self):
+        self.checkAddDetector('oo')
+
+    def testNumpyAddRemove(self):
+        self.checkAddRemove('numpy')
+
+    def testObjectsAddRemove(self):
+        self.checkAddRemove('oo')
+
+if __name__ == '__main__':
+    unittest.main()
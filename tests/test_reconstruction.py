@@ -0,0 +1,47 @@
+#!/usr/bin/env python2.7
+# test_reconstruction.py
+# Thomas Boser
+
+"""
+checks of the track finders on small generated events, run from the
+repository root with python2.7 -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'Reconstruction'))
+
+import Generation.particleController as pc
+import Reconstruction.reconstructionController as rc
+
+RADII = np.arange(1000., 8001., 1000.)
+
+def event(numparticles, seed = 3):
+    """ hit positions, layers and particle barcodes of a seeded event """
+    hbc, pbc, x, y, detpos = pc.particleController('numpy').generateEvent(
+        numparticles, seed = seed).hitArrays()
+    return np.column_stack((x, y)), detpos - 1, pbc
+
+class FollowTest(unittest.TestCase):
+    def testTracks(self):
+        """ every track is one particle and no hit is in two tracks """
+        xy, layer, pbc = event(2000)
+        tracks = rc.followTracks(xy, layer, RADII)
+        found = tracks[tracks >= 0]
+        self.assertEqual(len(found), len(np.unique(found)))
+        right = np.mean([len(set(pbc[t[t >= 0]])) == 1 for t in tracks])
+        self.assertGreater(right, 0.99)
+
+    def testNoLayers(self):
+        """ no detector layers give no tracks """
+        tracks = rc.followTracks(np.zeros((0, 2)), np.zeros(0, dtype=np.int64), [])
+        self.assertEqual(tracks.shape, (0, 0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python2.7
+# test_scoring.py
+# Thomas Boser
+
+"""
+checks of Analysis/scoring.py on hand built solutions, run from the
+repository root with python2.7 -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import Analysis.scoring as sc
+
+#two events, hit barcodes repeat between events
+TRUTH = b"""1,1, 2, 3, 4
+1,5, 6, 7
+1,8, 9
+2,1, 2, 3
+"""
+
+def score(pred, truth = TRUTH):
+    """ score of the solution text pred against truth """
+    return sc.scoreSoln(sc.parseSoln(truth), sc.parseSoln(pred))
+
+class ScoreTest(unittest.TestCase):
+    """ accuracy, efficiency and fake rate of typical predictions """
+    def checkScore(self, s, accuracy, efficiency, fakerate, predicted):
+        self.assertAlmostEqual(s['accuracy'], accuracy)
+        self.assertAlmostEqual(s['efficiency'], efficiency)
+        self.assertAlmostEqual(s['fakerate'], fakerate)
+        self.assertEqual(s['predicted'], predicted)
+        self.assertEqual(s['hits'], 12)
+        self.assertEqual(s['tracks'], 4)
+
+    def testPerfect(self):
+        #tracks and hits in any order
+        self.checkScore(score(b"2,3, 1, 2\n1,9, 8\n1,4, 3, 2, 1\n1,7, 5, 6\n"), 1, 1, 0, 4)
+
+    def testSplit(self):
+        #the first track in two, the smaller part matches no track
+        self.checkScore(score(b"1,1, 2, 3\n1,4\n1,5, 6, 7\n1,8, 9\n2,1, 2, 3\n"),
+                        1, 1, 1/5., 5)
+
+    def testMerged(self):
+        #the second and third track as one, the hits of the third are wrong
+        self.checkScore(score(b"1,1, 2, 3, 4\n1,5, 6, 7, 8, 9\n2,1, 2, 3\n"),
+                        10/12., 3/4., 0, 3)
+
+    def testFakes(self):
+        #tracks of hits that are not in the truth
+        self.checkScore(score(TRUTH + b"1,20, 21, 22\n2,20, 21\n"), 1, 1, 2/6., 6)
+        #a split off hit and a track of hits not in the truth
+        self.checkScore(score(b"1,1, 2, 3, 4\n1,5, 6, 7\n1,8, 9\n2,1\n2,2, 3\n1,30, 31\n"),
+                        1, 1, 2/6., 6)
+
+    def testUnmatchedTruth(self):
+        #no prediction for the second track and the second event
+        self.checkScore(score(b"1,1, 2, 3, 4\n1,8, 9\n"), 6/12., 2/4., 0, 2)
+
+    def testEmpty(self):
+        self.checkScore(score(b""), 0, 0, 0, 0)
+
+if __name__ == '__main__':
+    unittest.main()